@@ -2,42 +2,106 @@
 import os
 import sys
 import re
+import hashlib
+import json
+import math
+import numpy as np
+from scipy import sparse
 
 from sacrebleu.sacrebleu import sentence_bleu, TOKENIZERS
-from subprocess import check_output
+import shutil
+import subprocess
+import multiprocessing
+import itertools
+from collections import deque
+import filecache
+import lineindex
+import tree_kernel
+import minhash
+import parbleu
 
 thisdir=os.path.dirname(os.path.abspath(__file__))
 TREE_KERNEL_TOOL=thisdir + '/../tools/TreeKernel'
+# number of sentences whose pairwise scores are cached together while computing them (see pairwise_matrices)
+MATRIX_BLOCK_SIZE=1000
 
 '''
-Read one paraphrase file (one translation per line)
+Read one paraphrase file (one translation per line), optionally tokenised (through the tokenisation cache)
+and optionally only the selected segments (0-based line indices)
 '''
-def read_file(p_file):
-    contents = []
-    with open(p_file) as fp:
-        for line in fp:
-            contents.append(line.strip())
-    return contents
+def read_file(p_file, tokenize=None, segments=None):
+    return list(iter_file(p_file, tokenize, segments))
+
 
 '''
-Read the paraphrased references
+Iterate over the sentences of one paraphrase file (as read_file), reading one line at a time
+'''
+def iter_file(p_file, tokenize=None, segments=None):
+    if tokenize is not None:
+        yield from filecache.iter_tokenized(p_file, tokenize, segments=segments)
+    elif segments is not None:
+        for line in lineindex.iter_lines(p_file, segments):
+            yield line.strip()
+    else:
+        with open(p_file) as fp:
+            for line in fp:
+                yield line.strip()
 
-Args:
 
-- para_folder: the path to the folder containing the paraphrases. Files should be named
-               $langpair-n.en, where n is a number in the beam.
-- [-r reference_folder]: (optional) the path to the folder containing the reference files (whose 
-               names follow are of the form 'newstest2018-csen-ref.en')
-- [-n max_n]: a maximum number of paraphrases to include (default=-1, do not filter)
+'''
+Paraphrases of a language pair, read lazily: iterating yields one tuple of aligned sentences (one per
+file) at a time, reading the files line by line, so that memory does not depend on the number of
+files or sentences. It can be iterated several times
+'''
+class Paraphrases:
+
+    def __init__(self, files, tokenize=None, segments=None):
+        self.files = list(files)
+        self.tokenize = tokenize
+        self.segments = segments
+        self.num_sentences = None
+
+    def __iter__(self):
+        return zip(*[iter_file(p_file, self.tokenize, self.segments) for p_file in self.files])
+
+    def __len__(self):
+        if self.num_sentences is None:
+            self.num_sentences = sum(1 for _ in self)
+        return self.num_sentences
+
 
-Returns a dictionary containing for each language pair a list of tuples 
-(as many as there are sentences), each containing n paraphrases
 '''
-def read_files(para_folder, score_type=None, reference_folder=None, langpair=None, max_n=-1, secondary_para_folder=None):
-    paras = {}
+The paraphrases of a language pair (see Paraphrases) from the sentence `start` onwards
+'''
+class ResumedParaphrases:
+
+    def __init__(self, paraphrases, start):
+        self.paraphrases = paraphrases
+        self.start = start
+
+    def __iter__(self):
+        return itertools.islice(iter(self.paraphrases), self.start, None)
+
+    def __len__(self):
+        return max(len(self.paraphrases) - self.start, 0)
+
+
+# numeric index of a paraphrase file ($langpair-n.en), used to order the files
+def paraphrase_number(parafile):
+    matchname = re.match('.+?([^/]+)\-(\d+)\...', parafile)
+    return int(matchname.group(2)) if matchname else -1
+
+
+'''
+List the files of the paraphrased references (and of the original references if reference_folder is
+given), with the same arguments as read_files. Returns a dictionary containing for each language pair
+the list of files, in the order in which they are read
+'''
+def list_files(para_folder, score_type=None, reference_folder=None, langpair=None, max_n=-1, secondary_para_folder=None,
+               indices=None):
+    files = {}
 
     if reference_folder is not None:
-        os.sys.stderr.write("Reading references...")
         for reffile in os.listdir(reference_folder):
             if score_type == 'syntax':
                 refmatch = re.match('.+?\-(....)\-ref\.en\.parse', reffile)
@@ -48,15 +112,15 @@ def read_files(para_folder, score_type=None, reference_folder=None, langpair=Non
             lang = refmatch.group(1)
             if langpair is not None and lang != langpair:
                 continue
-            paras[lang] = [read_file(reference_folder + '/' + reffile)]
-        print('Done ' +  str(len(paras)) + ' references')
+            files[lang] = [reference_folder + '/' + reffile]
 
-    os.sys.stderr.write("Reading synthetic references...")
     filelist = [para_folder + '/' + x for x in os.listdir(para_folder) if re.match('.+?.en(\.parse)?$', x)]
-    filelist.extend([secondary_para_folder + '/' + x for x in os.listdir(secondary_para_folder) if re.match('.+?.en(\.parse)?$', x)])
+    if secondary_para_folder is not None:
+        filelist.extend([secondary_para_folder + '/' + x for x in os.listdir(secondary_para_folder) if re.match('.+?.en(\.parse)?$', x)])
 
 
-    for parafile in sorted(filelist, key=os.path.getmtime):
+    # ordered by paraphrase number (then name), e.g. deen-2.en before deen-10.en
+    for parafile in sorted(filelist, key=lambda x: (paraphrase_number(x), x)):
         # check that we want to look at this file
 
         # ignore file in these cases
@@ -68,25 +132,57 @@ def read_files(para_folder, score_type=None, reference_folder=None, langpair=Non
         testset = re.match('.*?(newstest201[89])', parafile).group(1)
         if max_n != -1 and int(num) > max_n:
             continue
+        if indices is not None and int(num) not in indices:
+            continue
 
         if langpair is not None and lang != langpair:
             continue
 
-        if lang + '-' + testset not in paras:
-            paras[lang + '-' + testset] = []
-        
-        # add to paraphrases
-        paras[lang + '-' + testset].append(read_file(parafile))
+        if lang + '-' + testset not in files:
+            files[lang + '-' + testset] = []
+        files[lang + '-' + testset].append(parafile)
 
-                  
+    return files
 
-    for lang in paras.keys():
-        print('Done. Read ' + str(len(paras[lang])) + ' paraphrases for lang ' + lang)
 
-    # organise by same sentence
-    for lang in paras:
-        zip_paras = list(zip(*paras[lang]))
-        paras[lang] = zip_paras
+'''
+Read the paraphrased references
+
+Args:
+
+- para_folder: the path to the folder containing the paraphrases. Files should be named
+               $langpair-n.en, where n is a number in the beam.
+- [-r reference_folder]: (optional) the path to the folder containing the reference files (whose 
+               names follow are of the form 'newstest2018-csen-ref.en')
+- [-n max_n]: a maximum number of paraphrases to include (default=-1, do not filter)
+- indices: (optional) only include the paraphrases with these numbers
+- tokenize: (optional) the name of the tokeniser to apply to the sentences
+- segments: (optional) only read these sentences (0-based line indices), e.g. a 500-sentence subsample
+
+Returns a dictionary containing for each language pair a (lazy) sequence of tuples
+(as many as there are sentences), each containing n paraphrases, in the order of their numbers
+'''
+def read_files(para_folder, score_type=None, reference_folder=None, langpair=None, max_n=-1, secondary_para_folder=None, tokenize=None, segments=None,
+               indices=None):
+    paras = {}
+    files = list_files(para_folder, score_type, reference_folder, langpair, max_n, secondary_para_folder, indices)
+
+    if reference_folder is not None:
+        os.sys.stderr.write("Reading references...")
+        for lang in files:
+            if '-' not in lang:
+                paras[lang] = Paraphrases(files[lang], tokenize, segments)
+        print('Done ' +  str(len(paras)) + ' references')
+
+    os.sys.stderr.write("Reading synthetic references...")
+    for lang in files:
+        if '-' in lang:
+            # add to paraphrases
+            paras[lang] = Paraphrases(files[lang], tokenize, segments)
+
+
+    for lang in paras.keys():
+        print('Done. Read ' + str(len(paras[lang].files)) + ' paraphrases for lang ' + lang)
 
     return paras
 
@@ -103,103 +199,599 @@ class BLEU:
         dp = (1 - sentence_bleu(sent1, sent2, smooth_method='exp').score / 100)
         return dp
 
+    '''
+    Scores of all ordered pairs of paraphrases of a sentence at once (row: hypothesis, column: reference),
+    identical to __call__. Each paraphrase is tokenised and its n-grams are extracted once, and the
+    clipped matches (symmetric) are computed for all pairs from the n-gram count vectors
+    '''
+    def pairwise(self, paras):
+        tokenizer = TOKENIZERS['13a']
+        tokens = [tokenizer(para.rstrip()).split() for para in paras]
+        counts = [parbleu.extract_ngrams(x) for x in tokens]
+
+        # count vectors over the n-grams of the sentence
+        vocab = {}
+        for ngrams in counts:
+            for ngram in ngrams:
+                vocab.setdefault(ngram, len(vocab))
+        vectors = np.zeros((len(paras), len(vocab)), dtype=np.int64)
+        orders = np.zeros((len(vocab), parbleu.NGRAM_ORDER), dtype=np.int64)
+        for p, ngrams in enumerate(counts):
+            for ngram, count in ngrams.items():
+                vectors[p, vocab[ngram]] = count
+        for ngram, i in vocab.items():
+            orders[i, len(ngram) - 1] = 1
+
+        lengths = np.array([len(x) for x in tokens], dtype=np.int64)
+        stats = np.zeros((len(paras), len(paras), parbleu.NUM_STATS), dtype=np.int64)
+        stats[..., parbleu.CORRECT] = np.minimum(vectors[:, np.newaxis], vectors[np.newaxis]) @ orders
+        stats[..., parbleu.TOTAL] = (vectors @ orders)[:, np.newaxis]
+        stats[..., parbleu.HYP_LEN] = lengths[:, np.newaxis]
+        stats[..., parbleu.REF_LEN] = lengths[np.newaxis]
+        return 1 - parbleu.bleu(stats, 'exp', use_effective_order=True) / 100
+
 '''
-BOW lexical overlap
+BOW lexical overlap (tokenize=None if the sentences are already tokenised)
 '''
 class BOW:
-    def __init__(self):
-        pass
+    def __init__(self, tokenize='13a'):
+        self.tokenize = tokenize
 
     def __call__(self, sent1, sent2):
-        tok1 = TOKENIZERS['13a'](sent1).split(' ')
-        tok2 = TOKENIZERS['13a'](sent2).split(' ')
+        if self.tokenize is not None:
+            sent1 = TOKENIZERS[self.tokenize](sent1)
+            sent2 = TOKENIZERS[self.tokenize](sent2)
+        tok1 = sent1.split(' ')
+        tok2 = sent2.split(' ')
         inter = set(tok1).intersection(tok2)
         lengths = (len(tok1)+len(tok2))/2
         dp = 1 - len(inter)/lengths
         return dp
 
+    '''
+    Scores of all pairs of paraphrases of each sentence of a language pair (one matrix per sentence),
+    identical to __call__. The tokens of the language pair are mapped to ids once and each paraphrase
+    is a row of a binary sparse matrix (built for chunks of sentences), so that the intersections of
+    all pairs of paraphrases of a sentence are given by a single product X.X^T (the lengths are the
+    numbers of tokens)
+    '''
+    def pairwise_all(self, sentences, chunksize=1000):
+        vocab = {}
+        sentences = iter(sentences)
+        # the sentences are read and scored by chunks
+        while True:
+            chunk = list(itertools.islice(sentences, chunksize))
+            if not chunk:
+                break
+            indices, indptr, lengths, offsets = [], [0], [], [0]
+            for paras in chunk:
+                for para in paras:
+                    if self.tokenize is not None:
+                        para = TOKENIZERS[self.tokenize](para)
+                    tokens = para.split(' ')
+                    indices.extend(sorted(set(vocab.setdefault(token, len(vocab)) for token in tokens)))
+                    indptr.append(len(indices))
+                    lengths.append(len(tokens))
+                offsets.append(len(lengths))
+            bow = sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(lengths), len(vocab)))
+            lengths = np.array(lengths)
+
+            for start, end in zip(offsets, offsets[1:]):
+                block = bow[start:end]
+                inter = (block @ block.T).toarray()
+                yield 1 - inter / ((lengths[start:end, np.newaxis] + lengths[np.newaxis, start:end]) / 2)
 
-def escape(string):
-    for char in ['`', '"', "'"]:
-        string = string.replace(char,'\\' + char)
-    return string
 
 '''
-Tree kernel diversity metric
+Jaccard distance between the sets of tokens (or of shingles of `shingle` consecutive tokens)
 '''
-class TreeKernel:
+class Jaccard:
+    def __init__(self, tokenize='13a', shingle=1):
+        self.tokenize = tokenize
+        self.shingle = shingle
+
+    def __call__(self, sent1, sent2):
+        if self.tokenize is not None:
+            sent1 = TOKENIZERS[self.tokenize](sent1)
+            sent2 = TOKENIZERS[self.tokenize](sent2)
+        set1 = minhash.shingles(sent1.split(' '), self.shingle)
+        set2 = minhash.shingles(sent2.split(' '), self.shingle)
+        return 1 - len(set1 & set2) / len(set1 | set2)
+
+    '''
+    Scores of all pairs of paraphrases of a sentence at once (a symmetric matrix)
+    '''
+    def pairwise(self, paras):
+        if self.tokenize is not None:
+            paras = [TOKENIZERS[self.tokenize](para) for para in paras]
+        sets = [minhash.shingles(para.split(' '), self.shingle) for para in paras]
+        scores = np.zeros((len(sets), len(sets)))
+        for i, set1 in enumerate(sets):
+            for j in range(i + 1, len(sets)):
+                scores[i, j] = scores[j, i] = 1 - len(set1 & sets[j]) / len(set1 | sets[j])
+        return scores
 
-    def __init__(self):
-        pass
+
+'''
+Approximate BOW or Jaccard diversity metric, estimated from the MinHash signatures of the paraphrases
+(see minhash.py), computed once per paraphrase. For BOW, the size of the intersection of two sets of
+tokens is obtained from their estimated Jaccard similarity J and their numbers of distinct tokens as
+J (|A| + |B|) / (1 + J), so that the error on each score is at most twice the error on J.
+
+For Jaccard, the average score of the pairs of paraphrases of a sentence is 1 minus their average
+Jaccard similarity, which is estimated directly from the signatures in time linear in the number of
+paraphrases (mean_score, used if `averaged`). The BOW score of a pair depends on the sizes of both
+sets, so it is always computed pair by pair
+'''
+class MinHashDiversity:
+    def __init__(self, metric_type='bow', num_perm=128, shingle=1, tokenize='13a'):
+        if metric_type == 'bow' and shingle != 1:
+            raise ValueError('The BOW metric is computed on tokens (shingle=1)')
+        self.metric_type = metric_type
+        self.minhash = minhash.MinHash(num_perm, shingle)
+        self.tokenize = tokenize
+        self.averaged = metric_type == 'jaccard'
+
+    def _tokens(self, paras):
+        if self.tokenize is not None:
+            paras = [TOKENIZERS[self.tokenize](para) for para in paras]
+        return [para.split(' ') for para in paras]
 
     def __call__(self, sent1, sent2):
+        return self.pairwise([sent1, sent2])[0, 1]
+
+    '''
+    Scores of all pairs of paraphrases of a sentence at once (a symmetric matrix)
+    '''
+    def pairwise(self, paras):
+        tokens = self._tokens(paras)
+        jaccard = minhash.pairwise_jaccard(self.minhash.signatures(tokens))
+        if self.metric_type == 'jaccard':
+            return 1 - jaccard
+        sizes = np.array([len(set(x)) for x in tokens])
+        lengths = np.array([len(x) for x in tokens])
+        inter = jaccard * (sizes[:, np.newaxis] + sizes[np.newaxis]) / (1 + jaccard)
+        return 1 - inter / ((lengths[:, np.newaxis] + lengths[np.newaxis]) / 2)
+
+    '''
+    Average Jaccard score of all pairs of paraphrases of a sentence (nan if there are fewer than 2)
+    '''
+    def mean_score(self, paras):
+        return float(1 - minhash.mean_jaccard(self.minhash.signatures(self._tokens(paras))))
+
+
+'''
+A pool of long-lived processes answering each line written to their stdin with one line on their
+stdout (e.g. compare-trees, which reads tab-separated pairs of trees). Requests are distributed over
+the processes in turn, with at most max_in_flight unanswered requests per process (so that neither
+pipe fills up), and the answers are returned in the order of the requests.
+'''
+class LinePool:
+
+    def __init__(self, command, processes=1, max_in_flight=64):
+        # the answers must not stay in the stdout buffer of the processes
+        if shutil.which('stdbuf') is not None:
+            command = ['stdbuf', '-oL'] + command
+        self.processes = [subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, encoding='utf-8')
+                          for _ in range(processes)]
+        self.max_in_flight = max_in_flight
+
+    def map(self, lines):
+        answers = []
+        pending = [deque() for _ in self.processes]
+
+        def collect(p):
+            self.processes[p].stdin.flush()
+            answer = self.processes[p].stdout.readline()
+            if answer == '':
+                raise EOFError('The process exited unexpectedly')
+            answers[pending[p].popleft()] = answer.strip()
+
+        for i, line in enumerate(lines):
+            p = i % len(self.processes)
+            if len(pending[p]) >= self.max_in_flight:
+                collect(p)
+            answers.append(None)
+            self.processes[p].stdin.write(line + '\n')
+            pending[p].append(i)
+        for p in range(len(self.processes)):
+            while pending[p]:
+                collect(p)
+        return answers
+
+    def close(self):
+        for process in self.processes:
+            process.stdin.close()
+            process.wait()
+
+
+'''
+Tree kernel diversity metric, computed with the compare-trees tool of TreeKernel (`tool`, by default
+TREE_KERNEL_TOOL), run as a pool of `processes` processes to which the trees are sent directly (one
+tab-separated pair per line), or in-process (see tree_kernel.py) if tool is None
+'''
+class TreeKernel:
 
-        command = 'echo \"' + escape(sent1) +'\t' + escape(sent2) + '\" | ' + TREE_KERNEL_TOOL + '/tree-kernel/compare-trees'
+    def __init__(self, lam=tree_kernel.LAMBDA, tool=TREE_KERNEL_TOOL, processes=1):
+        self.lam = lam
+        self.pool = None
+        if tool is not None:
+            self.pool = LinePool([tool + '/tree-kernel/compare-trees'], processes)
 
-        result = float(check_output(command, shell=True))
+    def __call__(self, sent1, sent2):
+        if self.pool is None:
+            result = tree_kernel.tree_kernel(sent1, sent2, self.lam)
+        else:
+            result = self._compare([(sent1, sent2)])[0]
 
         if str(result) != "nan":
             result = 1- result
         return result
 
+    def _compare(self, pairs):
+        return [float(x) for x in self.pool.map(clean_tree(sent1) + '\t' + clean_tree(sent2) for sent1, sent2 in pairs)]
+
+    '''
+    Scores of all pairs of paraphrases of a sentence at once (a symmetric matrix)
+    '''
+    def pairwise(self, paras):
+        if self.pool is None:
+            # nan stays nan
+            return 1 - tree_kernel.kernel_matrix(paras, self.lam)
+        pairs = [(p1, p2) for p1 in range(len(paras)) for p2 in range(p1 + 1, len(paras))]
+        results = self._compare([(paras[p1], paras[p2]) for p1, p2 in pairs])
+        scores = np.full((len(paras), len(paras)), float('nan'))
+        for (p1, p2), result in zip(pairs, results):
+            scores[p1, p2] = scores[p2, p1] = 1 - result
+        return scores
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+
+
+# trees are sent one pair per line, separated by a tab
+def clean_tree(tree):
+    return ' '.join(tree.split())
+
 '''
-Calculates the diversity of the paraphrases
+Scores of all pairs of paraphrases of each sentence (a matrix per sentence), for the metrics computing
+them at once, otherwise None for each sentence. If `averaged`, the metrics estimating the average score
+of the pairs of a sentence directly (see MinHashDiversity) give this average (a float) instead
 '''
-def diversity(all_paras, metric_type, lowercase=True):
+def pairwise_scores(metric, sentences, averaged=False):
+    if averaged and getattr(metric, 'averaged', False):
+        return (metric.mean_score(paras) for paras in sentences)
+    if hasattr(metric, 'pairwise_all'):
+        return metric.pairwise_all(sentences)
+    if hasattr(metric, 'pairwise'):
+        return (metric.pairwise(paras) for paras in sentences)
+    return (None for paras in sentences)
+
+
+# metric of a worker process (see parallel_pairwise_scores)
+_metric = None
+
+
+def _init_worker(metric_type, tokenized, metric_args):
+    global _metric
+    _metric = get_metric(metric_type, tokenized, **metric_args)
+
+
+def _chunk_scores(chunk, averaged=False):
+    return list(pairwise_scores(_metric, chunk, averaged))
+
 
-    if metric_type == 'bleu':
+'''
+Scores of all pairs of paraphrases of each sentence (as pairwise_scores), computed by a pool of
+`workers` processes, each with its own metric and scoring chunks of `chunksize` consecutive sentences.
+The scores are returned in the order of the sentences
+'''
+def parallel_pairwise_scores(metric_type, sentences, tokenized=False, workers=2, chunksize=20, averaged=False, **metric_args):
+    sentences = iter(sentences)
+    with multiprocessing.Pool(workers, _init_worker, (metric_type, tokenized, metric_args)) as pool:
+        # a few chunks per worker are read at a time
+        while True:
+            chunks = [list(itertools.islice(sentences, chunksize)) for _ in range(4 * workers)]
+            chunks = [chunk for chunk in chunks if chunk]
+            if not chunks:
+                break
+            for chunk_scores in pool.starmap(_chunk_scores, [(chunk, averaged) for chunk in chunks], chunksize=1):
+                yield from chunk_scores
+
+
+'''
+The diversity metric of a given type
+'''
+def get_metric(metric_type, tokenized=False, tree_kernel_lambda=tree_kernel.LAMBDA, tree_kernel_tool=TREE_KERNEL_TOOL,
+               tree_kernel_processes=1, num_perm=None, shingle=1):
+    if num_perm is not None:
+        metric = MinHashDiversity(metric_type, num_perm, shingle, None if tokenized else '13a')
+    elif metric_type == 'bleu':
         metric = BLEU()
     elif metric_type == 'bow':
-        metric = BOW()
+        metric = BOW(None if tokenized else '13a')
+    elif metric_type == 'jaccard':
+        metric = Jaccard(None if tokenized else '13a', shingle)
     elif metric_type == 'syntax':
-        metric = TreeKernel()
+        metric = TreeKernel(tree_kernel_lambda, tree_kernel_tool, tree_kernel_processes)
+    return metric
+
+
+# key of the cached pairwise scores of the files of a language pair (see pairwise_matrices)
+def _matrices_key(files, metric_type, segments=None, **metric_args):
+    params = [metric_type]
+    if metric_type == 'syntax':
+        params += [repr(metric_args.get('tree_kernel_lambda', tree_kernel.LAMBDA)),
+                   'internal' if metric_args.get('tree_kernel_tool', TREE_KERNEL_TOOL) is None else 'external']
+    if metric_type == 'jaccard':
+        params.append('shingle=' + str(metric_args.get('shingle', 1)))
+    if metric_args.get('num_perm') is not None:
+        params.append('minhash=' + str(metric_args['num_perm']))
+    if segments is not None:
+        params.append(hashlib.sha1(' '.join(str(seg) for seg in segments).encode('utf-8')).hexdigest())
+    return hashlib.sha1(' '.join(params + [filecache.file_hash(x) for x in files]).encode('utf-8')).hexdigest()
+
+
+'''
+Scores of all pairs of paraphrases of each sentence for the files of a language pair, as an array of
+shape (num_sentences, num_files, num_files). They are computed once and cached (as a compressed array
+file), keyed by the hashes of the files, the metric and the selected sentences, so that the scores of
+any subset of the files are sub-blocks of the cached array. `metric_args` are passed to get_metric
+'''
+def pairwise_matrices(files, metric_type, tokenize=None, segments=None, workers=1, **metric_args):
+    key = _matrices_key(files, metric_type, segments, **metric_args)
+    cached = filecache.cache_path('diversity', key, '.npz')
+    if os.path.exists(cached):
+        with np.load(cached) as arrays:
+            return arrays['scores']
+
+    # computed by blocks of sentences, each cached until all of them are done, so that an interrupted
+    # computation restarts from the last block
+    sentences = iter(Paraphrases(files, tokenize, segments))
+    metric = None
+    if workers <= 1:
+        metric = get_metric(metric_type, tokenize is not None, **metric_args)
+    blocks, block_files, start = [], [], 0
+    while True:
+        block = list(itertools.islice(sentences, MATRIX_BLOCK_SIZE))
+        if not block:
+            break
+        # named after the range of sentences of the block
+        block_cached = filecache.cache_path('diversity', key, '.' + str(start) + '-' + str(start + len(block)) + '.npz')
+        block_files.append(block_cached)
+        start += len(block)
+        if os.path.exists(block_cached):
+            with np.load(block_cached) as arrays:
+                blocks.append(arrays['scores'])
+            continue
+        if metric is None:
+            block_scores = list(parallel_pairwise_scores(metric_type, block, tokenize is not None, workers, **metric_args))
+        else:
+            block_scores = list(pairwise_scores(metric, block))
+        blocks.append(np.array(block_scores, dtype=np.float64).reshape(-1, len(files), len(files)))
+        filecache.atomic_write(block_cached, lambda fp: np.savez_compressed(fp, scores=blocks[-1]))
+    if metric is not None and hasattr(metric, 'close'):
+        metric.close()
+
+    scores = np.concatenate(blocks) if blocks else np.zeros((0, len(files), len(files)))
+    filecache.atomic_write(cached, lambda fp: np.savez_compressed(fp, scores=scores))
+    for block_cached in block_files:
+        os.remove(block_cached)
+    return scores
+
+
+'''
+Whether the pairwise scores of the files of a language pair are cached (see pairwise_matrices)
+'''
+def cached_matrices(files, metric_type, segments=None, **metric_args):
+    return os.path.exists(filecache.cache_path('diversity', _matrices_key(files, metric_type, segments, **metric_args), '.npz'))
+
+
+'''
+Scores of the selected files of each language pair (`files`, e.g. with -n) from the cached pairwise
+scores of all the files (`all_files`), see pairwise_matrices. Computing the scores of all the files
+costs up to (num_all_files / num_files)^2 times more than the selected pairs, so unless `build` is
+True, they are only used if they are already cached for every language pair, or if all the files are
+selected, and None is returned otherwise
+'''
+def select_matrices(files, all_files, metric_type, tokenize=None, segments=None, workers=1, build=False, **metric_args):
+    if not build and not all(files[lang] == all_files[lang] or cached_matrices(all_files[lang], metric_type, segments, **metric_args)
+                             for lang in files):
+        return None
+    matrices = {}
+    for lang in files:
+        scores = pairwise_matrices(all_files[lang], metric_type, tokenize, segments, workers, **metric_args)
+        selected = [all_files[lang].index(x) for x in files[lang]]
+        matrices[lang] = scores[:, selected][:, :, selected]
+    return matrices
+
+
+'''
+Results of a diversity run, written incrementally to a JSON-lines file, so that an interrupted run can
+be resumed. The file contains (one JSON object per line):
+
+- the configuration of the run: {"config": {...}}
+- checkpoints of the sentences of a language pair: {"lang": ..., "start": ..., "end": ..., "sum": ...},
+  where sum is the sum of the DPs of the sentences of the language pair up to end (excluded), and
+  "dps" the DPs of sentences start to end (null if there were no comparisons), if per_sentence
+- the result of a language pair: {"lang": ..., "dp": ..., "sum": ..., "num_sentences": ...}
+- the result over all language pairs: {"all": ..., "num_sentences": ...}
+
+If the file exists, it must have been written with the same configuration (a ValueError is raised
+otherwise). The language pairs that are finished are then not recomputed, the others restart from their
+last checkpoint, and the result over all language pairs is only written if the file does not have it yet
+'''
+class DiversityResults:
+
+    def __init__(self, filename, config, per_sentence=False, checkpoint_every=100):
+        self.filename = filename
+        self.per_sentence = per_sentence
+        self.checkpoint_every = checkpoint_every
+        self.finished = {}
+        self.checkpoints = {}
+        # overall result, if the file is complete
+        self.all = None
+        records = self._read() if os.path.exists(filename) else []
+        if records and records[0].get('config') != config:
+            raise ValueError('The results in ' + filename + ' were computed with a different configuration: ' +
+                             json.dumps(records[0].get('config')))
+        for record in records[1:]:
+            if 'dp' in record:
+                self.finished[record['lang']] = record
+            elif 'start' in record:
+                self.checkpoints[record['lang']] = record
+            elif 'all' in record:
+                self.all = record
+        self.fp = open(filename, 'a', encoding='utf-8')
+        if not records:
+            self.write({'config': config})
+
+    # records of the file, without a last line that was not completely written
+    def _read(self):
+        with open(self.filename, 'rb') as fp:
+            content = fp.read()
+        complete = content[:content.rfind(b'\n') + 1]
+        if len(complete) != len(content):
+            with open(self.filename, 'r+b') as fp:
+                fp.truncate(len(complete))
+        return [json.loads(line) for line in complete.decode('utf-8').split('\n') if line.strip() != '']
+
+    def write(self, record):
+        self.fp.write(json.dumps(record) + '\n')
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+
+    '''
+    Position (number of sentences done) and sum of the DPs from which to resume a language pair
+    '''
+    def resume(self, lang):
+        if lang in self.checkpoints:
+            return self.checkpoints[lang]['end'], self.checkpoints[lang]['sum']
+        return 0, 0
+
+    def checkpoint(self, lang, start, end, lang_dp, sentence_dps):
+        record = {'lang': lang, 'start': start, 'end': end, 'sum': lang_dp}
+        if self.per_sentence:
+            record['dps'] = sentence_dps
+        self.write(record)
+
+    def finish_lang(self, lang, dp, lang_dp, num_sentences):
+        self.finished[lang] = {'lang': lang, 'dp': dp, 'sum': lang_dp, 'num_sentences': num_sentences}
+        self.write(self.finished[lang])
+
+    # (not written again if the file is already complete, e.g. when a finished run is resumed)
+    def finish(self, all_dp, num_sentences):
+        if self.all is None:
+            self.all = {'all': all_dp, 'num_sentences': num_sentences}
+            self.write(self.all)
+
+    def close(self):
+        self.fp.close()
+
+
+'''
+Sum and number of the scores of the pairs of paraphrases of a sentence: all ordered pairs for BLEU
+(which is not symmetric), otherwise each pair once, without nan scores. The scores are taken from
+their matrix, or if it is None, computed by calling the metric on each pair. The scores are summed
+in the order of the pairs (np.cumsum adds them one by one), so that the sum does not depend on
+whether the matrix is given
+'''
+def sum_scores(metric_type, metric, paras, scores):
+    if scores is None:
+        if metric_type == 'bleu':
+            pairs = [(p1, p2) for p1 in range(len(paras)) for p2 in range(len(paras)) if p1 != p2]
+        else:
+            pairs = [(p1, p2) for p1 in range(len(paras)) for p2 in range(p1 + 1, len(paras))]
+        values = np.array([metric(paras[p1], paras[p2]) for p1, p2 in pairs], dtype=np.float64)
+    elif metric_type == 'bleu':
+        values = np.asarray(scores, dtype=np.float64)[~np.eye(len(paras), dtype=bool)]
+    else:
+        values = np.asarray(scores, dtype=np.float64)[np.triu_indices(len(paras), 1)]
+    if metric_type != 'bleu':
+        values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return 0, 0
+    return np.cumsum(values)[-1], len(values)
+
+
+'''
+Calculates the diversity of the paraphrases (tokenized=True if they have already been tokenised).
+If matrices are given (see select_matrices), the scores are taken from them rather than computed.
+If workers > 1, the scores are computed by a pool of processes, and summed in the same order as
+with a single process. If results are given (see DiversityResults), they are written as they are
+computed, and the language pairs and sentences already in them are skipped
+'''
+def diversity(all_paras, metric_type, lowercase=True, tokenized=False, tree_kernel_lambda=tree_kernel.LAMBDA,
+              tree_kernel_tool=TREE_KERNEL_TOOL, tree_kernel_processes=1, matrices=None, workers=1, num_perm=None, shingle=1,
+              results=None):
+
+    metric_args = {'tree_kernel_lambda': tree_kernel_lambda, 'tree_kernel_tool': tree_kernel_tool,
+                   'tree_kernel_processes': tree_kernel_processes, 'num_perm': num_perm, 'shingle': shingle}
+    metric = None
+    if matrices is None and workers <= 1:
+        metric = get_metric(metric_type, tokenized, **metric_args)
 
     os.sys.stderr.write("Calculating diversity metric "+ metric_type + "\n")
     dps = {}
     all_dp = 0
     for lang in sorted(list(all_paras.keys())):
+        if results is not None and lang in results.finished:
+            dps[lang] = results.finished[lang]['dp']
+            all_dp += results.finished[lang]['sum']
+            print('Done (from ' + results.filename + ').' + lang + ' = ' + str(dps[lang]))
+            continue
         print('Doing ' + lang + '...\r')
 
-        # sentence by sentence
-        lang_dp = 0
-        for p, paras in enumerate(all_paras[lang]):
+        # sentence by sentence (from the last checkpoint)
+        start, lang_dp = (0, 0) if results is None else results.resume(lang)
+        sentences = all_paras[lang]
+        if start > 0:
+            sentences = ResumedParaphrases(all_paras[lang], start)
+        if matrices is not None:
+            lang_scores = matrices[lang][start:]
+        elif workers > 1:
+            lang_scores = parallel_pairwise_scores(metric_type, sentences, tokenized, workers, averaged=True, **metric_args)
+        else:
+            lang_scores = pairwise_scores(metric, sentences, averaged=True)
+        checkpoint_start, sentence_dps = start, []
+        for p, (paras, scores) in enumerate(zip(sentences, lang_scores), start):
             os.sys.stderr.write("\t\t" + str(p) + '\r')
 
-            # Compute all pairs (once per pair)
-            sentence_dp = 0
-            num_comparisons = 0
-
-            # do full set of comparisons for bleu meitrc
-            if metric_type == 'bleu':
-                for p1, p1str in enumerate(paras):
-                    for p2, p2str in enumerate(paras):
-                        if p1 != p2:
-                            sentence_dp += metric(p1str, p2str)
-                            num_comparisons += 1
+            if isinstance(scores, float):
+                # average over the pairs, estimated directly
+                num_comparisons = 0 if math.isnan(scores) else 1
+                sentence_dp = scores if num_comparisons > 0 else 0
             else:
-                for p1, p1str in enumerate(paras):
-                    for p2, p2str in enumerate(paras[p1+1:], p1+1):
-                        score = metric(p1str, p2str)
-                        if str(score) != 'nan':
-                            
-                            sentence_dp += score
-                            num_comparisons += 1
+                sentence_dp, num_comparisons = sum_scores(metric_type, metric, paras, scores)
             if num_comparisons > 0:
                 sentence_dp /= num_comparisons
                 lang_dp += sentence_dp
 
+            if results is not None:
+                sentence_dps.append(sentence_dp if num_comparisons > 0 else None)
+                if p + 1 - checkpoint_start == results.checkpoint_every:
+                    results.checkpoint(lang, checkpoint_start, p + 1, lang_dp, sentence_dps)
+                    checkpoint_start, sentence_dps = p + 1, []
+
         num_sentences = len(all_paras[lang])
+        if results is not None and sentence_dps:
+            results.checkpoint(lang, checkpoint_start, num_sentences, lang_dp, sentence_dps)
 
         # average DP for the language        
         average_sentence_dp = lang_dp / num_sentences
         dps[lang] = average_sentence_dp
         all_dp += lang_dp
+        if results is not None:
+            results.finish_lang(lang, average_sentence_dp, lang_dp, num_sentences)
 
         print('Done.' + lang + ' = ' + str(dps[lang]))
 
     # average over all languages
     print([len(all_paras[lang]) for lang in all_paras])
     all_dp /= float(sum([len(all_paras[lang]) for lang in all_paras]))
+    if results is not None:
+        results.finish(all_dp, sum([len(all_paras[lang]) for lang in all_paras]))
 
     print('DP ' + metric_type + ' averaged over all languages = ' + str(all_dp))
     # print out
@@ -207,6 +799,9 @@ def diversity(all_paras, metric_type, lowercase=True):
     for lang in dps:
         print('\t' + lang + ' = ' + str(dps[lang]) + '\tCalculated on ' + str(len(all_paras[lang])) + ' sentences')
         
+    if metric is not None and hasattr(metric, 'close'):
+        metric.close()
+
     return dps, all_dp
 
 
@@ -215,13 +810,108 @@ if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('paraphrase_folder', help='folder containing referenced paraphrases')
-    parser.add_argument('metric', default='bleu', choices = ['bleu', 'bow', 'syntax'])
+    parser.add_argument('metric', default='bleu', choices = ['bleu', 'bow', 'syntax', 'jaccard'])
     parser.add_argument('--reference-folder', '-r', default=None, help='original reference folder')
     parser.add_argument('--langpair', '-l', default=None)
     parser.add_argument('--n', '-n', default=-1, type=int)
     parser.add_argument('-s', '--secondary_paraphrase_folder', help='secondary reference folder to be included in analysis (e.g. for other year)')
+    parser.add_argument('--lines', default=None, help='only use this range of sentences (START-END, 1-based and inclusive, e.g. 1-500)')
+    parser.add_argument('--line-file', default=None, help='only use the sentences whose line numbers (1-based) are listed in this file')
+    parser.add_argument('--tree-kernel-lambda', default=tree_kernel.LAMBDA, type=float, help='decay factor of the tree kernel (syntax)')
+    parser.add_argument('--in-process-tree-kernel', action='store_true', default=False,
+                        help='compute the tree kernel in-process (tree_kernel.py) instead of with the compare-trees tool of TreeKernel (in tools/)')
+    parser.add_argument('--tree-kernel-processes', default=1, type=int, help='number of compare-trees processes')
+    parser.add_argument('--indices', nargs='+', type=int, default=None, help='only include the paraphrases with these numbers')
+    parser.add_argument('--matrix-cache', action='store_true', default=False,
+                        help='compute and cache the scores of all paraphrases (if not cached yet), and derive those of the selected paraphrases from them')
+    parser.add_argument('--no-matrix-cache', action='store_true', default=False,
+                        help='compute the scores of the selected paraphrases only, even if the scores of all paraphrases are cached')
+    parser.add_argument('--workers', '-w', default=1, type=int, help='number of processes used to compute the scores')
+    parser.add_argument('--minhash', default=None, type=int,
+                        help='approximate the bow or jaccard metric using MinHash signatures of this size (e.g. 128)')
+    parser.add_argument('--shingle', default=1, type=int, help='compute the jaccard metric on shingles of this number of tokens')
+    parser.add_argument('--check', action='store_true', default=False,
+                        help='with --minhash, also compute the exact metric and compare')
+    parser.add_argument('--results', default=None,
+                        help='write the results to this JSON-lines file as they are computed, and resume from it if it exists')
+    parser.add_argument('--per-sentence', action='store_true', default=False, help='also write the DP of each sentence to the results file')
+    parser.add_argument('--checkpoint-every', default=100, type=int, help='number of sentences between checkpoints of the results file')
     args = parser.parse_args()
-    
-
-    paras = read_files(args.paraphrase_folder, args.metric, args.reference_folder, args.langpair, args.n, args.secondary_paraphrase_folder)
-    diversity(paras, args.metric, lowercase=True)
+    segments = lineindex.parse_segments(args.lines, args.line_file)
+
+    if args.matrix_cache and args.no_matrix_cache:
+        parser.error('only one of --matrix-cache and --no-matrix-cache can be given')
+    if args.minhash is not None and args.metric not in ('bow', 'jaccard'):
+        parser.error('--minhash is only available for the bow and jaccard metrics')
+    if args.metric == 'bow' and args.shingle != 1:
+        parser.error('the bow metric is computed on tokens (--shingle 1)')
+    if args.metric == 'syntax' and not args.in_process_tree_kernel and not os.path.exists(TREE_KERNEL_TOOL + '/tree-kernel/compare-trees'):
+        parser.error('compare-trees not found in ' + TREE_KERNEL_TOOL + '/tree-kernel: compile TreeKernel (see README) or use --in-process-tree-kernel')
+
+    if segments is not None:
+        selected_files = list_files(args.paraphrase_folder, args.metric, args.reference_folder, args.langpair, args.n,
+                                    args.secondary_paraphrase_folder, args.indices)
+        for filename in sorted(set(x for lang in selected_files for x in selected_files[lang])):
+            try:
+                lineindex.check_segments(segments, lineindex.count_lines(filename), filename)
+            except ValueError as e:
+                parser.error(str(e))
+
+    # BOW and Jaccard work on tokenised sentences, which are read from the tokenisation cache
+    tokenize = '13a' if args.metric in ('bow', 'jaccard') else None
+    metric_args = {'tree_kernel_lambda': args.tree_kernel_lambda,
+                   'tree_kernel_tool': None if args.in_process_tree_kernel else TREE_KERNEL_TOOL,
+                   'tree_kernel_processes': args.tree_kernel_processes,
+                   'num_perm': args.minhash, 'shingle': args.shingle}
+    paras = read_files(args.paraphrase_folder, args.metric, args.reference_folder, args.langpair, args.n, args.secondary_paraphrase_folder, tokenize, segments,
+                       args.indices)
+
+    # the scores of all the paraphrases are computed once (with --matrix-cache), those of the selected ones are sub-blocks
+    matrices = None
+    if not args.no_matrix_cache:
+        files = list_files(args.paraphrase_folder, args.metric, args.reference_folder, args.langpair, args.n, args.secondary_paraphrase_folder, args.indices)
+        all_files = list_files(args.paraphrase_folder, args.metric, args.reference_folder, args.langpair, -1, args.secondary_paraphrase_folder)
+        matrices = select_matrices(files, all_files, args.metric, tokenize, segments, args.workers, args.matrix_cache, **metric_args)
+
+    results = None
+    if args.results is not None:
+        config = {name: value for name, value in sorted(vars(args).items())
+                  if name not in ('results', 'per_sentence', 'checkpoint_every', 'check', 'workers', 'matrix_cache', 'no_matrix_cache',
+                                 'tree_kernel_processes')}
+        # paths are absolute, so that a run resumed from another folder has the same configuration
+        for name in ('paraphrase_folder', 'reference_folder', 'secondary_paraphrase_folder', 'line_file'):
+            if config[name] is not None:
+                config[name] = os.path.abspath(config[name])
+        # content of the input files, so that results are not resumed if they have changed
+        input_files = list_files(args.paraphrase_folder, args.metric, args.reference_folder, args.langpair, args.n,
+                                 args.secondary_paraphrase_folder, args.indices)
+        config['inputs'] = {lang: [filecache.file_hash(x) for x in input_files[lang]] for lang in sorted(input_files)}
+        if args.line_file is not None:
+            config['line_file_hash'] = filecache.file_hash(args.line_file)
+        try:
+            results = DiversityResults(args.results, config, args.per_sentence, args.checkpoint_every)
+        except ValueError as e:
+            parser.error(str(e))
+
+    dps, all_dp = diversity(paras, args.metric, lowercase=True, tokenized=tokenize is not None, matrices=matrices, workers=args.workers,
+                            results=results, **metric_args)
+    if results is not None:
+        results.close()
+
+    if args.minhash is not None:
+        bound = minhash.error_bound(args.minhash)
+        if args.metric == 'bow':
+            print('MinHash error bound (95%%): +/- %.4f on each pairwise score' % (2 * bound))
+        else:
+            print('MinHash error bound (95%%): +/- %.4f on each pairwise score and on the average' % bound)
+
+    if args.check and args.minhash is not None:
+        exact_args = dict(metric_args, num_perm=None)
+        if matrices is not None:
+            matrices = select_matrices(files, all_files, args.metric, tokenize, segments, args.workers, **exact_args)
+        exact_dps, exact_all_dp = diversity(paras, args.metric, lowercase=True, tokenized=tokenize is not None, matrices=matrices,
+                                            workers=args.workers, **exact_args)
+        print('Check against the exact metric:')
+        for lang in dps:
+            print('\t' + lang + ' = ' + str(dps[lang]) + '\texact = ' + str(exact_dps[lang]) + '\terror = %.6f' % (dps[lang] - exact_dps[lang]))
+        print('\tall = ' + str(all_dp) + '\texact = ' + str(exact_all_dp) + '\terror = %.6f' % (all_dp - exact_all_dp))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+"""
+On-disk cache of data derived from input files (e.g. tokenised text), shared by the scripts.
+
+Cached items are keyed by the hash of the content of the input files, so that they are
+invalidated as soon as an input file changes. The cache folder can be set using the
+PARBLEU_CACHE environment variable (default: ~/.cache/parbleu).
+"""
+
+import os
+import hashlib
+import tempfile
+import lineindex
+import numpy as np
+from sacrebleu.sacrebleu import TOKENIZERS
+
+CACHE_DIR = os.environ.get('PARBLEU_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'parbleu'))
+
+# file hashes already computed in this process, indexed by (path, mtime, size)
+_hashes = {}
+
+# parsed files already read in this process, indexed by (kind, key)
+_parsed = {}
+
+
+'''
+SHA1 hash of the content of a file
+'''
+def file_hash(filename):
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    key = (filename, stat.st_mtime_ns, stat.st_size)
+    if key not in _hashes:
+        sha1 = hashlib.sha1()
+        with open(filename, 'rb') as fp:
+            for block in iter(lambda: fp.read(1 << 20), b''):
+                sha1.update(block)
+        _hashes[key] = sha1.hexdigest()
+    return _hashes[key]
+
+
+'''
+Path of a cached item of a given kind (a subfolder of the cache folder)
+'''
+def cache_path(kind, key, extension=''):
+    return os.path.join(CACHE_DIR, kind, key + extension)
+
+
+'''
+Write to a file atomically (via a temporary file in the same folder), so that concurrent
+runs never see partially written cache files. `write` is called with the open binary file
+'''
+def atomic_write(filename, write):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            write(fp)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+
+
+'''
+Path of the cached tokenised version of a text file (one tokenised line per line), as produced by
+sacrebleu (each line is stripped of trailing whitespace and then tokenised). The file is tokenised
+line by line the first time, and cached, keyed by the content hash of the file and the tokeniser
+name. The file is read with universal newlines by default, or with newline='\n' as sacrebleu does
+for references.
+'''
+def tokenized_file(filename, tokenize='13a', newline=None):
+    key = file_hash(filename) + '.' + tokenize + ('.nl' if newline == '\n' else '')
+    cached = cache_path('tokenized', key)
+    if not os.path.exists(cached):
+        tokenizer = TOKENIZERS[tokenize]
+
+        def write(fp):
+            with open(filename, encoding='utf-8', newline=newline) as infile:
+                for line in infile:
+                    fp.write((tokenizer(line.rstrip()) + '\n').encode('utf-8'))
+        atomic_write(cached, write)
+    return cached
+
+
+'''
+Tokenised lines of a text file (see tokenized_file).
+
+If segments (0-based line indices) are given, only these lines are returned. They are read from
+the cached file using an index of its line offsets (also cached).
+'''
+def tokenize_file(filename, tokenize='13a', newline=None, segments=None):
+    cached = tokenized_file(filename, tokenize, newline)
+    if segments is not None:
+        return _line_index(cached).read(segments)
+    with open(cached, encoding='utf-8', newline='\n') as fp:
+        return fp.read().split('\n')[:-1]
+
+
+'''
+Iterate over the tokenised lines of a text file (only the selected segments if given), reading
+one line of the cached file at a time
+'''
+def iter_tokenized(filename, tokenize='13a', newline=None, segments=None):
+    cached = tokenized_file(filename, tokenize, newline)
+    if segments is not None:
+        return _line_index(cached).lines(segments)
+    return lineindex.iter_lines(cached)
+
+
+# line index of a cached file (cached files never change, so neither does their index)
+def _line_index(cached):
+    index_file = cached + '.idx.npy'
+    if os.path.exists(index_file):
+        return lineindex.LineIndex(cached, np.load(index_file))
+    index = lineindex.LineIndex(cached)
+    atomic_write(index_file, lambda fp: np.save(fp, index.offsets))
+    return index
+
+
+'''
+Content of an input file as parsed by parse(filename), e.g. a file of metric scores. It is parsed once
+and cached as a numpy archive, keyed by the kind of parsing, the path and the content hash of the file,
+and it is also kept in memory for the rest of the process. to_arrays converts the parsed content to a
+dictionary of arrays (to be saved), and from_arrays converts the loaded arrays back.
+'''
+def cached_parse(kind, filename, parse, to_arrays, from_arrays):
+    key = hashlib.sha1((os.path.abspath(filename) + '\t' + file_hash(filename)).encode('utf-8')).hexdigest()
+    if (kind, key) not in _parsed:
+        cached = cache_path(kind, key, '.npz')
+        if os.path.exists(cached):
+            with np.load(cached) as arrays:
+                parsed = from_arrays(arrays)
+        else:
+            parsed = parse(filename)
+            atomic_write(cached, lambda fp: np.savez(fp, **to_arrays(parsed)))
+        _parsed[kind, key] = parsed
+    return _parsed[kind, key]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+"""
+Line-range views of text files: read only some of the lines of a file (e.g. a subsample of the
+segments of a test set), by seeking to them using an index of line offsets, rather than creating
+truncated or filtered copies of the files.
+
+Segment selections are given either as a range of line numbers (START-END, 1-based and inclusive,
+e.g. 1-500 for the 500-sentence subsample) or as a file containing one line number per line (as
+the 'lines' files created in make_small_sets.sh).
+"""
+
+import os
+import mmap
+import numpy as np
+
+
+'''
+Parse a segment selection given as a range (START-END) or as a file of line numbers (1-based).
+Returns a list of 0-based line indices
+'''
+def parse_segments(lines=None, line_file=None):
+    if lines is not None:
+        start, end = lines.split('-')
+        return list(range(int(start) - 1, int(end)))
+    if line_file is not None:
+        with open(line_file) as fp:
+            return [int(line) - 1 for line in fp if line.strip() != '']
+    return None
+
+
+'''
+The first `maximum` segments (all of them if there are fewer than `maximum` lines, as head -n, when
+the number of lines is given)
+'''
+def first_segments(maximum, num_lines=None):
+    if maximum is None:
+        return None
+    return list(range(maximum if num_lines is None else min(maximum, num_lines)))
+
+
+'''
+Check that the selected segments (0-based line indices) are lines of a file of num_lines lines, and
+raise a ValueError otherwise
+'''
+def check_segments(segments, num_lines, filename='the file'):
+    if segments is not None:
+        for seg in segments:
+            if seg < 0 or seg >= num_lines:
+                raise ValueError('Line ' + str(seg + 1) + ' is not in ' + filename + ' (' + str(num_lines) + ' lines)')
+    return segments
+
+
+'''
+The segments selected in a file of num_lines lines: the given segments (checked with check_segments),
+or the first `maximum` segments, or None (all segments) if neither is given
+'''
+def select_segments(num_lines, segments=None, maximum=None, filename='the file'):
+    if segments is not None:
+        return check_segments(segments, num_lines, filename)
+    return first_segments(maximum, num_lines)
+
+
+'''
+Number of lines of a file (the last line counts even without a final newline)
+'''
+def count_lines(filename):
+    return len(line_offsets(filename)) - 1
+
+
+'''
+Index of the offsets of the lines of a file, used to read any subset of its lines
+'''
+class LineIndex:
+
+    def __init__(self, filename, offsets=None):
+        self.filename = filename
+        self.offsets = line_offsets(filename) if offsets is None else offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    '''
+    Read the lines with the given 0-based indices (without their newline characters)
+    '''
+    def read(self, segments, encoding='utf-8'):
+        return list(self.lines(segments, encoding))
+
+    '''
+    Iterate over the lines with the given 0-based indices, reading one line at a time
+    '''
+    def lines(self, segments, encoding='utf-8'):
+        with open(self.filename, 'rb') as fp:
+            for seg in segments:
+                if seg < 0 or seg >= len(self):
+                    raise ValueError('Line ' + str(seg + 1) + ' is not in ' + self.filename + ' (' + str(len(self)) + ' lines)')
+                start, end = self.offsets[seg], self.offsets[seg + 1]
+                fp.seek(start)
+                yield fp.read(end - start).decode(encoding).rstrip('\n')
+
+
+'''
+Offsets of the beginning of each line, plus the end of the file (an array of length num_lines + 1)
+'''
+def line_offsets(filename):
+    size = os.path.getsize(filename)
+    if size == 0:
+        return np.zeros(1, dtype=np.int64)
+    with open(filename, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        content = np.frombuffer(mm, dtype=np.uint8)
+        newlines = np.flatnonzero(content == ord('\n'))
+        del content
+    ends = newlines + 1
+    # last line without a final newline
+    if len(ends) == 0 or ends[-1] != size:
+        ends = np.append(ends, size)
+    return np.concatenate([[0], ends]).astype(np.int64)
+
+
+'''
+Iterate over the selected lines of a file (all of them if segments is None), without newline
+characters, reading one line at a time
+'''
+def iter_lines(filename, segments=None, encoding='utf-8'):
+    if segments is None:
+        with open(filename, encoding=encoding, newline='\n') as fp:
+            for line in fp:
+                yield line.rstrip('\n')
+    else:
+        yield from LineIndex(filename).lines(segments, encoding)
+
+
+'''
+Read the selected lines of a file (all of them if segments is None), without newline characters
+'''
+def read_lines(filename, segments=None, encoding='utf-8'):
+    if segments is None:
+        with open(filename, encoding=encoding, newline='\n') as fp:
+            return [line.rstrip('\n') for line in fp]
+    return LineIndex(filename).read(segments, encoding)
@@ -1,11 +1,12 @@
 #!/bin/python
 import metric_correlation_syslevel as mcsys
 import metric_correlation_seglevel as mcseg
+import metric_correlation_cells as mccells
 import os
 
 def get_all_lang_correlations(mc, baseline, gold, system):
     # get correlation results
-    baseline_results, system_results, sigs = mc.get_results(gold, baseline, system)
+    baseline_results, system_results, sigs = mccells.get_results(mc, gold, baseline, system)
 
     assert len(system_results) == 1 and 'de-en' in system_results
     
@@ -130,4 +131,10 @@ def write_table(metric):
     
 if __name__ == '__main__':
 
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', '-w', default=1, type=int, help='number of processes used to compute the correlations')
+    args = parser.parse_args()
+
+    mccells.compute_all('newstest2019', ['bleu'], subsets=['.500'], workers=args.workers)
     write_table('bleu')
@@ -2,11 +2,12 @@
 
 import metric_correlation_syslevel as mcsys
 import metric_correlation_seglevel as mcseg
+import metric_correlation_cells as mccells
 import os
 
 def get_all_lang_correlations(mc, baseline, gold, system):
     # get correlation results
-    baseline_results, system_results, sigs = mc.get_results(gold, baseline, system)
+    baseline_results, system_results, sigs = mccells.get_results(mc, gold, baseline, system)
 
     lp_scores = []
     for lp in sorted(list(system_results.keys())):
@@ -158,6 +159,8 @@ if __name__ == '__main__':
     parser.add_argument('testset', choices=('newstest2018', 'newstest2019'))
     parser.add_argument('metric', choices=('bleu', 'meteor'))
     parser.add_argument('level', choices=('seg', 'sys'))
+    parser.add_argument('--workers', '-w', default=1, type=int, help='number of processes used to compute the correlations')
     args = parser.parse_args()
 
+    mccells.compute_all(args.testset, [args.metric], [args.level], subsets=[''], workers=args.workers)
     write_raw_table(args.testset, args.metric, args.level)
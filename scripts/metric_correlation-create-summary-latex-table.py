@@ -1,11 +1,12 @@
 #!/usr/bin/pytho
 import metric_correlation_syslevel as mcsys
 import metric_correlation_seglevel as mcseg
+import metric_correlation_cells as mccells
 import os
 
 def get_summary_correlations(mc, baseline, gold, system):
     # get correlation results
-    baseline_results, system_results, sigs = mc.get_results(gold, baseline, system)
+    baseline_results, system_results, sigs = mccells.get_results(mc, gold, baseline, system)
 
     relgains = [(lp, 100 * ((system_results[lp][0]/baseline_results[lp][0]) - 1), system_results[lp][1], sigs[lp]) \
                 for lp in system_results]
@@ -34,7 +35,7 @@ def get_summary_correlations(mc, baseline, gold, system):
     
 def get_summary_correlations_small(mc, baseline, gold, system):
     # get correlation results
-    baseline_results, system_results, sigs = mc.get_results(gold, baseline, system)
+    baseline_results, system_results, sigs = mccells.get_results(mc, gold, baseline, system)
 
     assert len(system_results) == 1 and 'de-en' in system_results
 
@@ -258,7 +259,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('metric', choices=('bleu', 'meteor'))
     parser.add_argument('testset', choices=('newstest2018', 'newstest2019'))
+    parser.add_argument('--workers', '-w', default=1, type=int, help='number of processes used to compute the correlations')
     args = parser.parse_args()
 
-    
+    mccells.compute_all(args.testset, [args.metric], workers=args.workers)
     write_summary_table(args.metric, args.testset)
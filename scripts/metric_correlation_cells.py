@@ -0,0 +1,139 @@
+#!/usr/bin/python
+
+"""
+Correlations of metric scores with human judgments, as used in the cells of the LaTeX tables
+(metric_correlation-create-*-latex-table.py).
+
+The result of each cell (get_results of metric_correlation_syslevel or metric_correlation_seglevel
+for a human judgment file, a baseline score file and a system score file) is cached, keyed by the
+level, the seed of the bootstrap resampling, the version of the cell format (CELL_VERSION) and the
+content hashes of the three files, so that only the cells whose files have changed are recomputed. All the cells of a test set can be computed
+beforehand by a pool of processes (compute_all).
+"""
+
+import os
+import re
+import glob
+import json
+import hashlib
+import multiprocessing
+import filecache
+import metric_correlation_syslevel as mcsys
+import metric_correlation_seglevel as mcseg
+
+thisdir = os.path.dirname(os.path.abspath(__file__)) + '/'
+
+# seed of the bootstrap resampling (seg-level significance): the cells of all systems use the same
+# resamples for each language pair (see metric_correlation_seglevel.batch_significance)
+SEED = mcseg.SEED
+
+LEVELS = {'sys': mcsys, 'seg': mcseg}
+
+# version of the cached cells: to be increased whenever the computation of the correlations (or the
+# format of their results) changes, so that the cells cached by previous versions are not used
+CELL_VERSION = 2
+
+SUBSETS = ('', '.500')
+
+
+# level of a correlation module
+def get_level(mc):
+    return 'sys' if mc is mcsys else 'seg'
+
+
+# path of the cached result of a cell
+def cell_path(level, gold, baseline, system, seed=SEED):
+    params = [level, 'seed=' + str(seed), 'version=' + str(CELL_VERSION)] + [filecache.file_hash(x) for x in (gold, baseline, system)]
+    return filecache.cache_path('correlations', hashlib.sha1(' '.join(params).encode('utf-8')).hexdigest(), '.json')
+
+
+# results as returned by get_results (the correlation and number of items of each language pair, and
+# the significance of each language pair)
+def _from_json(results):
+    baseline_results, system_results, sigs = results
+    return ({lp: tuple(x) for lp, x in baseline_results.items()},
+            {lp: tuple(x) for lp, x in system_results.items()},
+            sigs)
+
+
+'''
+Correlation results for a system (as mc.get_results), cached (see cell_path)
+'''
+def get_results(mc, gold, baseline, system, seed=SEED):
+    cached = cell_path(get_level(mc), gold, baseline, system, seed)
+    if os.path.exists(cached):
+        with open(cached) as fp:
+            return _from_json(json.load(fp))
+
+    if mc is mcseg:
+        results = mc.get_results(gold, baseline, system, seed=seed)
+    else:
+        results = mc.get_results(gold, baseline, system)
+    filecache.atomic_write(cached, lambda fp: fp.write(json.dumps(results).encode('utf-8')))
+    return results
+
+
+'''
+All the cells of a test set: for each level (sys or seg), subset ('' for the full test set or '.500' for
+the 500-sentence subset) and each metric (bleu or meteor), the baseline and each metric score file found in the method folders of
+metric-scores/TESTSET/. Returns a list of (level, gold, baseline, system), for the existing files only
+'''
+def table_cells(testset, metrics=('bleu', 'meteor'), levels=('sys', 'seg'), subsets=SUBSETS):
+    cells = []
+    system_prefix = thisdir + '../metric-scores/' + testset + '/'
+    for level in levels:
+        for subset in subsets:
+            if level == 'sys':
+                gold = thisdir + '../metrics-task/DA-syslevel-' + testset + '.csv'
+            else:
+                gold = thisdir + '../metrics-task/RR-seglevel-' + testset + subset + '.csv'
+            for metric in metrics:
+                baseline = system_prefix + ('sacreBLEU' if metric == 'bleu' else 'Meteor') + '-' + level + 'level' + subset + '.tsv'
+                if not os.path.exists(gold) or not os.path.exists(baseline):
+                    continue
+                systems = glob.glob(system_prefix + '*/par' + metric + '-*' + level + 'level' + subset + '.tsv')
+                # e.g. parbleu-laser.num=5-syslevel.tsv, parbleu-constrained-laser.syslevel.tsv
+                systems = [x for x in systems if re.match('par' + metric + '-.+[-.]' + level + 'level' + re.escape(subset) + '\.tsv$',
+                                                          os.path.basename(x))]
+                cells.extend((level, gold, baseline, system) for system in [baseline] + sorted(systems))
+    return cells
+
+
+# compute a cell in a worker process (errors are raised again when the table is written)
+def _compute_cell(cell):
+    level, gold, baseline, system = cell
+    try:
+        get_results(LEVELS[level], gold, baseline, system)
+    except Exception as e:
+        os.sys.stderr.write('Could not compute ' + system + ' (' + level + '-level): ' + str(e) + '\n')
+
+
+'''
+Compute the cells of a test set (see table_cells) that are not cached yet, using a pool of `workers`
+processes
+'''
+def compute_all(testset, metrics=('bleu', 'meteor'), levels=('sys', 'seg'), subsets=SUBSETS, workers=1):
+    cells = [cell for cell in table_cells(testset, metrics, levels, subsets) if not os.path.exists(cell_path(*cell))]
+    os.sys.stderr.write('Computing ' + str(len(cells)) + ' correlation cells\n')
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            for _ in pool.imap_unordered(_compute_cell, cells):
+                pass
+    else:
+        for cell in cells:
+            _compute_cell(cell)
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Compute (and cache) all the correlation cells of a test set')
+    parser.add_argument('testset', choices=('newstest2018', 'newstest2019'))
+    parser.add_argument('--metric', choices=('bleu', 'meteor'), nargs='+', default=('bleu', 'meteor'))
+    parser.add_argument('--level', choices=('sys', 'seg'), nargs='+', default=('sys', 'seg'))
+    parser.add_argument('--subset', choices=('full', '500'), nargs='+', default=('full', '500'))
+    parser.add_argument('--workers', '-w', default=1, type=int, help='number of processes')
+    args = parser.parse_args()
+
+    subsets = ['' if x == 'full' else '.' + x for x in args.subset]
+    compute_all(args.testset, args.metric, args.level, subsets, args.workers)
@@ -3,6 +3,7 @@ import numpy as np
 import gzip
 import re
 import os
+import filecache
 
 # normalise the names
 def normalise(name, lp):
@@ -14,9 +15,69 @@ def normalise(name, lp):
     return name
 
 
-# read the human DA scores file
+# interned names (e.g. of systems or segments): each name is numbered in order of first appearance
+class Vocabulary:
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        idx = self.ids.get(name)
+        if idx is None:
+            idx = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return idx
+
+    # indices in another vocabulary of the names of this one (-1 if absent)
+    def map_to(self, other):
+        return np.array([other.ids.get(name, -1) for name in self.names], dtype=np.int64)
+
+
+# relative ranking judgments of a language pair, as integer arrays (one value per comparison):
+# segment, better system and worse system (indices in the vocabularies segments and systems).
+# Comparisons are in the order of their segments (in order of first appearance), and then in
+# order of appearance
+class Judgments:
+
+    def __init__(self):
+        self.segments = Vocabulary()
+        self.systems = Vocabulary()
+        self.segment = np.zeros(0, dtype=np.int64)
+        self.better = np.zeros(0, dtype=np.int64)
+        self.worse = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.segment)
+
+    @property
+    def num_segments(self):
+        return len(self.segments)
+
+
+# metric scores of a language pair, as a (segments x systems) matrix (nan if missing) and a mask
+# of the scores present (scores can also be nan)
+class ScoreMatrix:
+
+    def __init__(self, segments, systems, scores, mask):
+        self.segments = segments
+        self.systems = systems
+        self.scores = scores
+        self.mask = mask
+
+
+# read the human DA scores file (parsed once and cached, see filecache.cached_parse)
 def read_ref(filename):
-    lp2scores = {}
+    return filecache.cached_parse('judgments-seglevel', filename, _read_ref, _judgments_to_arrays, _judgments_from_arrays)
+
+
+def _read_ref(filename):
+    lp2judgments = {}
+    # (segment, better, worse) of each language pair, and comparisons already seen
+    lp2comparisons = {}
     with open(filename) as fp:
         # discard first header line
         fp.readline()
@@ -29,29 +90,42 @@ def read_ref(filename):
                 continue
 
             # add comparison
-            if lp not in lp2scores:
-                lp2scores[lp] = {}
-            if segid not in lp2scores[lp]:
-                lp2scores[lp][segid] = {}
+            if lp not in lp2judgments:
+                lp2judgments[lp] = Judgments()
+                lp2comparisons[lp] = ([], set())
+            judgments = lp2judgments[lp]
+            comparisons, seen = lp2comparisons[lp]
 
             # normalise names
-            better = normalise(better, lp)
-            worse = normalise(worse, lp)
+            comparison = (judgments.segments.intern(segid),
+                          judgments.systems.intern(normalise(better, lp)),
+                          judgments.systems.intern(normalise(worse, lp)))
 
             # should not be duplicate entries of comparisons
-            if (better, worse) in lp2scores[lp][segid]:
+            if comparison in seen:
                 print("error")
+                continue
+            seen.add(comparison)
 
-            # add comparison - better is always first, but is also the value
-            lp2scores[lp][segid][(better, worse)] = better
-        
-    return lp2scores
+            # add comparison - better is always first
+            comparisons.append(comparison)
 
+    for lp, judgments in lp2judgments.items():
+        comparisons = np.array(lp2comparisons[lp][0], dtype=np.int64).reshape(-1, 3)
+        # grouped by segment
+        comparisons = comparisons[np.argsort(comparisons[:, 0], kind='stable')]
+        judgments.segment, judgments.better, judgments.worse = comparisons.T.copy()
 
-# read the metrics scores file
+    return lp2judgments
+
+
+# read the metrics scores file (parsed once and cached, see filecache.cached_parse)
 def read_scores(filename):
-    lp2scores = {}
-    systems = []
+    return filecache.cached_parse('scores-seglevel', filename, _read_scores, _scores_to_arrays, _scores_from_arrays)
+
+
+def _read_scores(filename):
+    lp2entries = {}
     if '.gz' in filename:
         fp = gzip.open(filename, 'rt')
     else:
@@ -70,51 +144,178 @@ def read_scores(filename):
         score = score.split()[0] 
         
         # add metric score for individual systems
-        if lp not in lp2scores:
-            lp2scores[lp] = {}
-        if segid not in lp2scores[lp]:
-            lp2scores[lp][segid] = {}
-        lp2scores[lp][segid][system] = float(score)
+        if lp not in lp2entries:
+            lp2entries[lp] = (Vocabulary(), Vocabulary(), [], [], [])
+        segments, systems, rows, columns, scores = lp2entries[lp]
+        rows.append(segments.intern(segid))
+        columns.append(systems.intern(system))
+        scores.append(float(score))
     fp.close()
 
+    lp2scores = {}
+    for lp, (segments, systems, rows, columns, scores) in lp2entries.items():
+        matrix = np.full((len(segments), len(systems)), np.nan)
+        mask = np.zeros((len(segments), len(systems)), dtype=bool)
+        # the last score of a system for a segment is kept
+        matrix[rows, columns] = scores
+        mask[rows, columns] = True
+        lp2scores[lp] = ScoreMatrix(segments, systems, matrix, mask)
+
     return lp2scores
 
+
+# cached versions of the judgments and scores (one set of arrays per language pair)
+def _judgments_to_arrays(lp2judgments):
+    arrays = {'lps': np.array(list(lp2judgments), dtype=str)}
+    for i, judgments in enumerate(lp2judgments.values()):
+        arrays['segments_%d' % i] = np.array(judgments.segments.names, dtype=str)
+        arrays['systems_%d' % i] = np.array(judgments.systems.names, dtype=str)
+        arrays['comparisons_%d' % i] = np.array([judgments.segment, judgments.better, judgments.worse])
+    return arrays
+
+
+def _judgments_from_arrays(arrays):
+    lp2judgments = {}
+    for i, lp in enumerate(arrays['lps'].tolist()):
+        judgments = lp2judgments[lp] = Judgments()
+        judgments.segments = _vocabulary(arrays['segments_%d' % i])
+        judgments.systems = _vocabulary(arrays['systems_%d' % i])
+        judgments.segment, judgments.better, judgments.worse = arrays['comparisons_%d' % i]
+    return lp2judgments
+
+
+def _scores_to_arrays(lp2scores):
+    arrays = {'lps': np.array(list(lp2scores), dtype=str)}
+    for i, scores in enumerate(lp2scores.values()):
+        arrays['segments_%d' % i] = np.array(scores.segments.names, dtype=str)
+        arrays['systems_%d' % i] = np.array(scores.systems.names, dtype=str)
+        arrays['scores_%d' % i] = scores.scores
+        arrays['mask_%d' % i] = scores.mask
+    return arrays
+
+
+def _scores_from_arrays(arrays):
+    lp2scores = {}
+    for i, lp in enumerate(arrays['lps'].tolist()):
+        lp2scores[lp] = ScoreMatrix(_vocabulary(arrays['segments_%d' % i]), _vocabulary(arrays['systems_%d' % i]),
+                                    arrays['scores_%d' % i], arrays['mask_%d' % i])
+    return lp2scores
+
+
+def _vocabulary(names):
+    vocabulary = Vocabulary()
+    for name in names.tolist():
+        vocabulary.intern(name)
+    return vocabulary
+
+
+# concordant and discordant comparisons (as in correlate), as flat boolean arrays with one
+# value per comparison, in the order of the judgments. Comparisons whose systems are not both
+# scored are neither concordant nor discordant
+def compile_comparisons(hscores, sscores):
+    # segments and systems of the judgments in the score matrix
+    rows = hscores.segments.map_to(sscores.segments)[hscores.segment]
+    better = hscores.systems.map_to(sscores.systems)[hscores.better]
+    worse = hscores.systems.map_to(sscores.systems)[hscores.worse]
+
+    # ignore non-present ones (???)
+    present = (rows >= 0) & (better >= 0) & (worse >= 0)
+    present[present] = sscores.mask[rows[present], better[present]] & sscores.mask[rows[present], worse[present]]
+
+    # get scores for each system
+    better_scores = np.zeros(len(hscores))
+    worse_scores = np.zeros(len(hscores))
+    better_scores[present] = sscores.scores[rows[present], better[present]]
+    worse_scores[present] = sscores.scores[rows[present], worse[present]]
+
+    # ties are discordant
+    concordant = present & (better_scores > worse_scores)
+    discordant = present & ~concordant
+    return concordant, discordant
+
+
+# seed of the resampling of batch_significance
+SEED = 12345
+
+
+# bootstrap resampling of the Kendall tau of several metrics, given their concordant and discordant
+# comparisons (a list of pairs of arrays, see compile_comparisons), with the same resamples for all
+# metrics, drawn from `random` (np.random or a RandomState). Returns an array (metrics x repetitions).
+# Each repetition draws as many comparisons as there are, with replacement. If `resample_all` is False
+# (as in the original significance tests, used for the tables of the paper), only the first (number of
+# segments) draws are kept, and each comparison drawn is only counted once
+def bootstrap_taus(hscores, comparisons, repetitions=1000, random=np.random, resample_all=False):
+    concordant = np.array([x[0] for x in comparisons]).reshape(len(comparisons), -1)
+    discordant = np.array([x[1] for x in comparisons]).reshape(len(comparisons), -1)
+    num_values = concordant.shape[1]
+
+    # the repetitions are drawn in blocks of at most ~10M indices (per metric)
+    block = max(1, 10000000 // max(num_values * len(comparisons), 1))
+    taus = []
+    for start in range(0, repetitions, block):
+        # draw with replacement (the same draws as np.random.choice(num_values, num_values) for each
+        # repetition)
+        sampled_indices = random.randint(0, num_values, size=(min(block, repetitions - start), num_values))
+        if resample_all:
+            concord = concordant[:, sampled_indices].sum(axis=2)
+            discord = discordant[:, sampled_indices].sum(axis=2)
+        else:
+            sampled_indices = np.sort(sampled_indices[:, :hscores.num_segments], axis=1)
+            first = np.ones(sampled_indices.shape, dtype=bool)
+            first[:, 1:] = sampled_indices[:, 1:] != sampled_indices[:, :-1]
+            concord = (concordant[:, sampled_indices] & first).sum(axis=2)
+            discord = (discordant[:, sampled_indices] & first).sum(axis=2)
+
+        # calculate the scores (nan if there are no comparisons)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            taus.append((concord - discord) / (concord + discord))
+
+    return np.concatenate(taus, axis=1)
+
+
 # calculate significance levels
 def bootstrap_resampling(hscores, bscores, sscores):
     repetitions = 1000
-    fixed_values = []
-    
-    for segid in hscores:
-        fixed_values.extend( [(segid, x) for x in hscores[segid].items()] )
-    value_indices = np.arange(0, len(fixed_values))
-        
-    all_taus = []
-    for i in range(repetitions):
-        # draw with replacement
-        # of format segid: {better_sys, worse_sys}
-        sampled_indices = np.random.choice(value_indices, (len(value_indices)), replace=True)
-
-        # get the samples (only need to select hscores really, because they are filtered
-        # in correlate
-        hsamples = {}
-        for i in range(len(hscores)):
-            idx = sampled_indices[i]
-            segid, values = fixed_values[idx]
-            if segid not in hsamples:
-                hsamples[segid] = {}
-            hsamples[segid][values[0]] = values[1]
-            
-        # calculate the scores
-        stau, _ = correlate(hsamples, sscores)
-        btau, _ = correlate(hsamples, bscores)
 
-        all_taus.append((stau, btau))
+    # the comparisons are indexed once for both metrics
+    staus, btaus = bootstrap_taus(hscores, [compile_comparisons(hscores, sscores), compile_comparisons(hscores, bscores)],
+                                  repetitions)
 
     # number where s is better than b
-    p = len([_ for x in all_taus if x[1] >= x[0]])/repetitions
+    p = np.count_nonzero(btaus >= staus)/repetitions
 
     return p
-        
+
+
+# significance of several candidate metrics (a list of score files as returned by read_scores) against a
+# baseline, in one pass: for each language pair, the comparisons are resampled once (with a RandomState
+# seeded with `seed`) and the same resamples are used for all the metrics, so that their p-values can be
+# compared (and do not depend on the other candidates). All the comparisons are resampled, unless
+# `resample_all` is False (see bootstrap_taus). Returns the correlations of the baseline
+# (lp: (tau, number of comparisons)) and, for each candidate, its correlations and p-values (lp: p)
+def batch_significance(hscores, bscores, candidates, repetitions=1000, seed=SEED, resample_all=True):
+    baseline_results = {}
+    results = [{} for _ in candidates]
+    p = [{} for _ in candidates]
+    for lp in sorted(list(hscores)):
+
+        # only for languages specified in the system files
+        lp_candidates = [i for i, sscores in enumerate(candidates) if lp in sscores]
+        if lp not in bscores or not lp_candidates:
+            continue
+
+        comparisons = [compile_comparisons(hscores[lp], bscores[lp])]
+        comparisons += [compile_comparisons(hscores[lp], candidates[i][lp]) for i in lp_candidates]
+        baseline_results[lp] = kendall_tau(*comparisons[0])
+
+        taus = bootstrap_taus(hscores[lp], comparisons, repetitions, np.random.RandomState(seed), resample_all)
+        for c, i in enumerate(lp_candidates, 1):
+            results[i][lp] = kendall_tau(*comparisons[c])
+            # number where the candidate is better than the baseline
+            p[i][lp] = np.count_nonzero(taus[0] >= taus[c])/repetitions
+
+    return baseline_results, results, p
+
 
 def correlate_all_lps(hscores, bscores, sscores):
     # for each language pair
@@ -140,37 +341,39 @@ def correlate_all_lps(hscores, bscores, sscores):
 
 
 def correlate(hscores, sscores):
-    results = {'concord': 0, 'discord': 0}
-    
-    for segid in hscores:
-        # get judgments for this segment
-        for comparison in hscores[segid]:
-            # ignore non-present ones (???)
-            if segid not in sscores or comparison[0] not in sscores[segid] or \
-               comparison[1] not in sscores[segid]:
-                continue
+    return kendall_tau(*compile_comparisons(hscores, sscores))
 
-            # get better and worse system
-            better_system = hscores[segid][comparison]
-            worse_system = comparison[1] if better_system == comparison[0] else comparison[0] # other system
-            
-            # get BLEU scores for each system
-            better_sys_score = sscores[segid][better_system]
-            worse_sys_score = sscores[segid][worse_system]
-                
-            # concordant or discordant
-            if better_sys_score == worse_sys_score:
-                results['discord'] += 1 
-            elif better_sys_score > worse_sys_score:
-                results['concord'] += 1
-            else:
-                results['discord'] += 1
 
-    tau = (results['concord'] - results['discord']) / float(results['concord'] + results['discord'])
+# Kendall tau from the concordant and discordant comparisons, and number of comparisons
+def kendall_tau(concordant, discordant):
+    concord, discord = int(concordant.sum()), int(discordant.sum())
+
+    tau = (concord - discord) / float(concord + discord)
+
+    return (tau, concord + discord)
+
+
+# significance level of a p-value
+def significance(p):
+    if p <= 0.001:
+        sig_str = '***'
+    elif p <= 0.01:
+        sig_str = '**'
+    elif p <= 0.05:
+        sig_str = '*'
+    else:
+        sig_str = ''
+    return sig_str
 
-    return (tau, results['concord'] + results['discord'])
 
-def get_results(human_scores, baseline_scores, system_scores, just_scores=False):
+# correlations of the baseline and of the system, and significance of the system for each language pair.
+# If a seed is given, the significance is computed as in batch_significance, otherwise with np.random. In
+# both cases, the comparisons are resampled as in the original significance tests (see bootstrap_taus)
+def get_results(human_scores, baseline_scores, system_scores, just_scores=False, seed=None):
+    if seed is not None:
+        baseline_correlations, results, sigs = get_batch_results(human_scores, baseline_scores, [system_scores], seed, False)
+        return baseline_correlations[0], results[0], sigs[0]
+
     hscores = read_ref(human_scores)
     sscores = read_scores(system_scores)
     bscores = read_scores(baseline_scores)    
@@ -184,42 +387,35 @@ def get_results(human_scores, baseline_scores, system_scores, just_scores=False)
         baseline_correlations[lp] = correlate(hscores[lp], bscores[lp])
 
         # also calculate system's p value
-        if p[lp] <= 0.001:
-            sig_str = '***'
-        elif p[lp] <= 0.01:
-            sig_str = '**'
-        elif p[lp] <= 0.05:
-            sig_str = '*'
-        else:
-            sig_str = ''
-        sigs[lp] = sig_str
+        sigs[lp] = significance(p[lp])
                 
     return baseline_correlations, results, sigs
 
 
-def print_results(human_scores, baseline_scores, system_scores, just_scores=False):
+# correlations of the baseline, and correlations and significance of several systems (lists of one dictionary
+# per system), with the same resamples for all systems (see batch_significance)
+def get_batch_results(human_scores, baseline_scores, system_scores, seed=SEED, resample_all=True):
     hscores = read_ref(human_scores)
-    sscores = read_scores(system_scores)
     bscores = read_scores(baseline_scores)
+    baseline_correlations, results, p = batch_significance(hscores, bscores, [read_scores(x) for x in system_scores], seed=seed,
+                                                           resample_all=resample_all)
+    sigs = [{lp: significance(x[lp]) for lp in x} for x in p]
+    # baseline correlations of the language pairs of each system
+    return [{lp: baseline_correlations[lp] for lp in x} for x in results], results, sigs
+
+
+def print_results(human_scores, baseline_scores, system_scores, just_scores=False, seed=SEED, resample_all=True):
+    _, all_results, all_sigs = get_batch_results(human_scores, baseline_scores, system_scores, seed, resample_all)
     
-    results, p = correlate_all_lps(hscores, bscores, sscores)
-    
-    if not args.just_scores:
-        print(' '.join(sorted(results)))
-        print(' '.join([str(results[lp][1]) for lp in sorted(results)]))
-        
-    for lp in sorted(results):
-        sig_str = ''
-        
-        if p[lp] <= 0.001:
-            sig_str = '***'
-        elif p[lp] <= 0.01:
-            sig_str = '**'
-        elif p[lp] <= 0.05:
-            sig_str = '*'
-            
-        print('& %.3f' % results[lp][0] + sig_str, end=' ')
-    print('\\\\')
+    if not just_scores:
+        print(' '.join(sorted(all_results[0])))
+        print(' '.join([str(all_results[0][lp][1]) for lp in sorted(all_results[0])]))
+
+    # one line per system
+    for results, sigs in zip(all_results, all_sigs):
+        for lp in sorted(results):
+            print('& %.3f' % results[lp][0] + sigs[lp], end=' ')
+        print('\\\\')
                 
                 
 if __name__ == '__main__':
@@ -228,9 +424,13 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('human_scores', help="Human RR scores file")
     parser.add_argument('baseline_scores', help="Baseline scores file")
-    parser.add_argument('system_scores', help="Metric scores file")
+    parser.add_argument('system_scores', nargs='+', help="Metric scores file(s) (significance is computed with the same resamples for all)")
     parser.add_argument('--just_scores', help="Only output scores", action="store_true", default=False)
+    parser.add_argument('--seed', help="Seed of the bootstrap resampling", type=int, default=SEED)
+    parser.add_argument('--legacy-resampling', action='store_true', default=False,
+                        help="Resample as the original significance tests (the first NUM_SEGMENTS draws, without duplicates)")
     args = parser.parse_args()
 
 
-    print_results(args.human_scores, args.baseline_scores, args.system_scores, args.just_scores)
+    print_results(args.human_scores, args.baseline_scores, args.system_scores, args.just_scores, args.seed,
+                  not args.legacy_resampling)
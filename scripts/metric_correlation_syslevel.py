@@ -3,6 +3,7 @@ import numpy as np
 import gzip
 import re
 import williams
+import filecache
 from scipy.stats.stats import pearsonr
 
 
@@ -14,8 +15,12 @@ def normalise(name, lp):
     return name
 
 
-# read the human DA scores file
+# read the human DA scores file (parsed once and cached, see filecache.cached_parse)
 def read_ref(filename):
+    return _copy(filecache.cached_parse('judgments-syslevel', filename, _read_ref, _to_arrays, _from_arrays))
+
+
+def _read_ref(filename):
     lp2scores = {}
     with open(filename) as fp:
         # discard first header line
@@ -31,8 +36,12 @@ def read_ref(filename):
 
     return lp2scores
     
-# read the metrics scores file
+# read the metrics scores file (parsed once and cached, see filecache.cached_parse)
 def read_scores(filename):
+    return _copy(filecache.cached_parse('scores-syslevel', filename, _read_scores, _to_arrays, _from_arrays))
+
+
+def _read_scores(filename):
     lp2scores = {}
     if '.gz' in filename:
         fp = gzip.open(filename, 'rt')
@@ -61,6 +70,25 @@ def read_scores(filename):
     return lp2scores
 
 
+# cached version of the scores (the systems and scores of each language pair)
+def _to_arrays(lp2scores):
+    arrays = {'lps': np.array(list(lp2scores), dtype=str)}
+    for i, scores in enumerate(lp2scores.values()):
+        arrays['systems_%d' % i] = np.array(list(scores), dtype=str)
+        arrays['scores_%d' % i] = np.array(list(scores.values()), dtype=float)
+    return arrays
+
+
+def _from_arrays(arrays):
+    return {lp: dict(zip(arrays['systems_%d' % i].tolist(), arrays['scores_%d' % i].tolist()))
+            for i, lp in enumerate(arrays['lps'].tolist())}
+
+
+# the cached scores are shared, so a copy is returned
+def _copy(lp2scores):
+    return {lp: dict(scores) for lp, scores in lp2scores.items()}
+
+
 def correlate(hscores, sscores, neg=False):
     # for each language pair
     c = {}
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""
+MinHash signatures of sets of tokens (or of token n-gram shingles), to estimate the Jaccard similarity
+|A & B| / |A | B| of pairs of sentences from the proportion of positions at which their signatures agree,
+without comparing the sets themselves.
+
+The signature of a set is, for each of num_perm hash functions h_k(x) = (a_k x + b_k) mod (2^61 - 1)
+applied to the CRC32 of its elements, the minimum hash value. The hash functions only depend on the
+seed, so signatures computed separately can be compared.
+
+For a signature size K, the estimate of each Jaccard similarity, as well as the average of the estimates
+over any set of pairs (each position of the signatures being an independent trial), is within
+sqrt(ln(2 / delta) / (2 K)) of its expectation with probability 1 - delta (Hoeffding's inequality).
+"""
+
+import math
+import zlib
+import numpy as np
+
+PRIME = (1 << 61) - 1
+
+
+'''
+MinHash signatures with num_perm hash functions, over the shingles of `shingle` consecutive tokens
+'''
+class MinHash:
+
+    def __init__(self, num_perm=128, shingle=1, seed=1):
+        self.num_perm = num_perm
+        self.shingle = shingle
+        random = np.random.RandomState(seed)
+        # a * x stays below 2^64 for 32-bit x
+        self.a = random.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = random.randint(0, PRIME, size=num_perm, dtype=np.uint64)
+
+    '''
+    Signature of a set of strings (an array of num_perm hash values)
+    '''
+    def signature(self, elements):
+        values = np.array([zlib.crc32(x.encode('utf-8')) for x in elements], dtype=np.uint64)
+        if len(values) == 0:
+            return np.full(self.num_perm, PRIME, dtype=np.uint64)
+        hashes = (values[:, np.newaxis] * self.a % PRIME + self.b) % PRIME
+        return hashes.min(axis=0)
+
+    '''
+    Signatures of several lists of tokens, as an array of shape (num_lists, num_perm)
+    '''
+    def signatures(self, token_lists):
+        return np.array([self.signature(shingles(tokens, self.shingle)) for tokens in token_lists]).reshape(-1, self.num_perm)
+
+
+'''
+The set of shingles of n consecutive tokens of a list of tokens (the whole list if it is shorter)
+'''
+def shingles(tokens, n=1):
+    if n == 1:
+        return set(tokens)
+    if len(tokens) <= n:
+        return set([' '.join(tokens)])
+    return set(' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+
+
+'''
+Estimated Jaccard similarities of all pairs of signatures (shape (num_sets, num_perm)), as a matrix
+(accumulated one position at a time, so that memory is quadratic in the number of signatures only)
+'''
+def pairwise_jaccard(signatures):
+    agreeing = np.zeros((len(signatures), len(signatures)), dtype=np.int64)
+    for column in signatures.T:
+        agreeing += column[:, np.newaxis] == column[np.newaxis]
+    return agreeing / signatures.shape[1]
+
+
+'''
+Estimated average Jaccard similarity over all pairs of signatures, in time linear in the number of
+signatures: for each position, the number of agreeing pairs is the sum over distinct values of
+c (c - 1) / 2, where c is the number of signatures with that value
+'''
+def mean_jaccard(signatures):
+    num_sets = len(signatures)
+    if num_sets < 2:
+        return float('nan')
+    agreeing = 0
+    for column in signatures.T:
+        counts = np.unique(column, return_counts=True)[1]
+        agreeing += (counts * (counts - 1) // 2).sum()
+    return agreeing / (signatures.shape[1] * num_sets * (num_sets - 1) / 2)
+
+
+'''
+Bound on the error of an estimated Jaccard similarity (or of an average of estimates) with
+probability 1 - delta, for a signature size of num_perm
+'''
+def error_bound(num_perm, delta=0.05):
+    return math.sqrt(math.log(2 / delta) / (2 * num_perm))
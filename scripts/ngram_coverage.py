@@ -13,6 +13,7 @@ if more than one reference:
 import os
 import sacrebleu
 import sys
+import filecache
 
 from collections import Counter
 
@@ -33,16 +34,13 @@ def main(args):
     else:
         systems = args.systems
 
-    sys_fhs = [open(ref) for ref in systems]
-    ref_fhs = [open(system) for system in args.refs]
-
-    tokenize = sacrebleu.TOKENIZERS["13a"]
+    # tokenised lines (cached)
+    sys_lines = [filecache.tokenize_file(system) for system in systems]
+    ref_lines = [filecache.tokenize_file(ref) for ref in args.refs]
 
     stats = Counter()
     totals = Counter()
-    for lineno, (syss, refs) in enumerate(zip(zip(*sys_fhs), zip(*ref_fhs)), 1):
-        syss = [tokenize(system) for system in syss]
-        refs = [tokenize(ref) for ref in refs]
+    for lineno, (syss, refs) in enumerate(zip(zip(*sys_lines), zip(*ref_lines)), 1):
 
         # All system n-grams.
         sys_ngrams = Counter()
@@ -12,18 +12,18 @@ if more than one reference:
 
 import sacrebleu
 import sys
+import filecache
 
 from collections import Counter
 
 def main(args):
 
-    sys_fhs = [open(ref) for ref in args.systems]
-    ref_fhs = [open(sys) for sys in args.refs]
+    # tokenised lines (cached)
+    sys_lines = [filecache.tokenize_file(sys) for sys in args.systems]
+    ref_lines = [filecache.tokenize_file(ref) for ref in args.refs]
 
     stats = Counter()
-    for lineno, (syss, refs) in enumerate(zip(zip(*sys_fhs), zip(*ref_fhs)), 1):
-        syss = [sacrebleu.tokenize_13a(sys) for sys in syss]
-        refs = [sacrebleu.tokenize_13a(ref) for ref in refs]
+    for lineno, (syss, refs) in enumerate(zip(zip(*sys_lines), zip(*ref_lines)), 1):
 
         # Find all ngrams in refs#2+ that are not in ref#1
         ref_ngrams = Counter()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+"""
+In-process multi-reference BLEU, equivalent to the sacrebleu (1.4.10) calls made
+in sacreBLEU-{sys,seg}level.sh (default 13a tokenisation, case-sensitive, exp smoothing).
+
+References are read and tokenised once and kept in memory, so that any number of
+hypothesis files can be scored against them without starting a new process.
+Scores are computed from per-segment sufficient statistics, stored as rows of an
+integer array with the following columns:
+
+    [correct_1..correct_4, total_1..total_4, hyp_len, ref_len]
+"""
+
+import os
+import math
+import numpy as np
+import filecache
+from collections import Counter
+from sacrebleu.sacrebleu import NGRAM_ORDER, my_log
+
+# column indices of the sufficient statistics
+CORRECT = slice(0, NGRAM_ORDER)
+TOTAL = slice(NGRAM_ORDER, 2 * NGRAM_ORDER)
+HYP_LEN = 2 * NGRAM_ORDER
+REF_LEN = 2 * NGRAM_ORDER + 1
+NUM_STATS = 2 * NGRAM_ORDER + 2
+
+
+'''
+Read a text file and tokenise it (through the tokenisation cache), returning lists of tokens
+(optionally only for the selected segments, given as 0-based line indices). sacrebleu reads
+references with newline='\n' and the hypothesis (stdin) with universal newlines
+'''
+def read_tokenized(filename, tokenize='13a', segments=None, newline=None):
+    return [line.split() for line in filecache.tokenize_file(filename, tokenize, newline, segments)]
+
+
+'''
+Extract all n-grams (1 <= n <= max_order) from a list of tokens
+'''
+def extract_ngrams(tokens, max_order=NGRAM_ORDER):
+    ngrams = Counter()
+    for n in range(1, max_order + 1):
+        for i in range(0, len(tokens) - n + 1):
+            ngrams[tuple(tokens[i: i + n])] += 1
+    return ngrams
+
+
+'''
+A set of references (one or more files with the same number of lines), tokenised once.
+
+For each segment, keeps the maximum count of each n-gram over all references
+(used for clipping) and the lengths of the individual references (used to find
+the closest reference length).
+'''
+class References:
+
+    def __init__(self, ref_files, tokenize='13a', segments=None):
+        self.ref_files = list(ref_files)
+        self.tokenize = tokenize
+        self.segments = segments
+        self.ngrams = None
+        self.lengths = None
+        for ref_file in self.ref_files:
+            self.add(read_tokenized(ref_file, tokenize, segments, newline='\n'))
+
+    def __len__(self):
+        return 0 if self.ngrams is None else len(self.ngrams)
+
+    '''
+    Add one tokenised reference stream to the set
+    '''
+    def add(self, ref_stream):
+        if self.ngrams is None:
+            self.ngrams = [Counter() for _ in ref_stream]
+            self.lengths = [[] for _ in ref_stream]
+        if len(ref_stream) != len(self.ngrams):
+            raise EOFError("Reference streams have different lengths!")
+
+        for seg, tokens in enumerate(ref_stream):
+            seg_ngrams = self.ngrams[seg]
+            for ngram, count in extract_ngrams(tokens).items():
+                if count > seg_ngrams[ngram]:
+                    seg_ngrams[ngram] = count
+            self.lengths[seg].append(len(tokens))
+
+    '''
+    Length of the reference closest in length to the hypothesis (shortest one if tied)
+    '''
+    def closest_length(self, seg, hyp_len):
+        return closest_length(self.lengths[seg], hyp_len)
+
+
+def closest_length(ref_lengths, hyp_len):
+    closest_diff, closest_len = None, None
+    for reflen in ref_lengths:
+        diff = abs(hyp_len - reflen)
+        if closest_diff is None or diff < closest_diff:
+            closest_diff, closest_len = diff, reflen
+        elif diff == closest_diff and reflen < closest_len:
+            closest_len = reflen
+    return closest_len
+
+
+'''
+Compute the sufficient statistics of each segment of a tokenised hypothesis stream
+against a set of references. Returns an integer array of shape (num_segments, NUM_STATS)
+'''
+def segment_statistics(hyp_stream, references):
+    if len(hyp_stream) != len(references):
+        raise EOFError("Source and reference streams have different lengths!")
+
+    stats = np.zeros((len(hyp_stream), NUM_STATS), dtype=np.int64)
+    for seg, tokens in enumerate(hyp_stream):
+        ref_ngrams = references.ngrams[seg]
+        row = [0] * NUM_STATS
+        for ngram, count in extract_ngrams(tokens).items():
+            n = len(ngram)
+            row[n - 1] += min(count, ref_ngrams.get(ngram, 0))
+            row[NGRAM_ORDER + n - 1] += count
+        row[HYP_LEN] = len(tokens)
+        row[REF_LEN] = references.closest_length(seg, len(tokens))
+        stats[seg] = row
+    return stats
+
+
+'''
+BLEU scores computed from an array of statistics of shape (..., NUM_STATS), one score per row,
+giving exactly the same results as sacrebleu's compute_bleu (smooth_method 'exp' or 'none').
+
+All operations are vectorised, except for the logarithms and exponentials, which are computed with
+the math module (numpy's implementations can differ from it in the last bit)
+'''
+def bleu(stats, smooth_method='exp', use_effective_order=False):
+    if smooth_method not in ('exp', 'none'):
+        raise ValueError('Unsupported smoothing method: ' + smooth_method)
+
+    stats = np.asarray(stats)
+    correct = stats[..., CORRECT]
+    total = stats[..., TOTAL]
+    sys_len = stats[..., HYP_LEN]
+    ref_len = stats[..., REF_LEN]
+
+    # orders are only considered up to the first one without any n-grams
+    active = np.logical_and.accumulate(total > 0, axis=-1)
+    nonzero = correct > 0
+    safe_total = np.where(active, total, 1)
+    if smooth_method == 'exp':
+        smooth_mteval = 2. ** np.cumsum(active & ~nonzero, axis=-1)
+        smoothed = 100. / (smooth_mteval * safe_total)
+    else:
+        smoothed = np.zeros(total.shape)
+    precisions = np.where(active, np.where(nonzero, 100. * correct / safe_total, smoothed), 0.)
+
+    if use_effective_order:
+        effective_order = active.sum(axis=-1)
+        effective_order[effective_order == 0] = NGRAM_ORDER
+    else:
+        effective_order = np.full(sys_len.shape, NGRAM_ORDER)
+
+    # sum of the log precisions, in order
+    logs = _log(precisions)
+    log_sum = np.zeros(sys_len.shape)
+    for n in range(NGRAM_ORDER):
+        log_sum = log_sum + np.where(n < effective_order, logs[..., n], 0.)
+
+    safe_sys_len = np.where(sys_len > 0, sys_len, 1)
+    brevity_penalty = np.where(sys_len < ref_len,
+                               np.where(sys_len > 0, _exp(1 - ref_len / safe_sys_len), 0.), 1.)
+
+    return brevity_penalty * _exp(log_sum / effective_order)
+
+
+def _log(x):
+    return np.asarray(np.frompyfunc(my_log, 1, 1)(x), dtype=np.float64)
+
+
+def _exp(x):
+    return np.asarray(np.frompyfunc(math.exp, 1, 1)(x), dtype=np.float64)
+
+
+'''
+Corpus-level BLEU from the summed statistics of all segments (as sacrebleu -b)
+'''
+def corpus_bleu(stats, smooth_method='exp'):
+    return float(bleu(np.asarray(stats).sum(axis=-2), smooth_method))
+
+
+'''
+Sentence-level BLEU for each segment (as sacrebleu -sl, with effective order)
+'''
+def sentence_bleu(stats, smooth_method='exp'):
+    return bleu(stats, smooth_method, use_effective_order=True)
+
+
+'''
+Bootstrap resampling of segments: a matrix of shape (num_samples, num_segments) giving the number
+of times each segment is drawn in each resample (each resample draws num_segments segments with
+replacement). The same seed gives the same resamples, so that scores computed with the same matrix
+(e.g. for different systems or numbers of references) are paired
+'''
+def bootstrap_counts(num_segments, num_samples=1000, seed=None):
+    indices = np.random.RandomState(seed).randint(0, num_segments, size=(num_samples, num_segments))
+    indices += np.arange(num_samples)[:, np.newaxis] * num_segments
+    return np.bincount(indices.ravel(), minlength=num_samples * num_segments).reshape(num_samples, num_segments)
+
+
+'''
+Corpus-level BLEU of each bootstrap resample, from the per-segment statistics (num_segments, NUM_STATS)
+and the resample counts of bootstrap_counts
+'''
+def bootstrap_bleu(stats, counts, smooth_method='exp'):
+    return bleu(counts @ np.asarray(stats, dtype=np.int64), smooth_method)
+
+
+'''
+References for several nested subsets of the same reference files at once (e.g. the
+original reference plus paraphrases 1..k for several values of k).
+
+Each reference is given a number (0 for the original reference, i for the ith paraphrase) and is
+included in every subset whose cut point is >= its number. For each segment and n-gram, the
+maximum counts are kept as a running maximum over the references, recorded at each cut point.
+'''
+class NestedReferences:
+
+    def __init__(self, numbered_ref_files, cuts, tokenize='13a', segments=None):
+        self.cuts = sorted(cuts)
+        self.tokenize = tokenize
+        self.segments = segments
+        self.ngrams = None
+        self.lengths = None
+        self.numbers = []
+        for num, ref_file in sorted(numbered_ref_files):
+            self.add(read_tokenized(ref_file, tokenize, segments, newline='\n'), num)
+
+    def __len__(self):
+        return 0 if self.ngrams is None else len(self.ngrams)
+
+    '''
+    Add one tokenised reference stream with its number
+    '''
+    def add(self, ref_stream, num):
+        if self.ngrams is None:
+            self.ngrams = [{} for _ in ref_stream]
+            self.lengths = [[] for _ in ref_stream]
+        if len(ref_stream) != len(self.ngrams):
+            raise EOFError("Reference streams have different lengths!")
+
+        # index of the first subset including this reference
+        first = len([cut for cut in self.cuts if cut < num])
+        num_cuts = len(self.cuts)
+        self.numbers.append(num)
+
+        for seg, tokens in enumerate(ref_stream):
+            seg_ngrams = self.ngrams[seg]
+            for ngram, count in extract_ngrams(tokens).items():
+                counts = seg_ngrams.get(ngram)
+                if counts is None:
+                    counts = seg_ngrams[ngram] = [0] * num_cuts
+                for c in range(first, num_cuts):
+                    if count > counts[c]:
+                        counts[c] = count
+            self.lengths[seg].append(len(tokens))
+
+    '''
+    Closest reference length within each subset
+    '''
+    def closest_lengths(self, seg, hyp_len):
+        return [closest_length([length for length, num in zip(self.lengths[seg], self.numbers) if num <= cut], hyp_len)
+                for cut in self.cuts]
+
+
+'''
+Compute the sufficient statistics of a tokenised hypothesis stream against each of the nested
+reference subsets in a single pass. Returns an array of shape (num_cuts, num_segments, NUM_STATS)
+'''
+def nested_segment_statistics(hyp_stream, references):
+    if len(hyp_stream) != len(references):
+        raise EOFError("Source and reference streams have different lengths!")
+
+    num_cuts = len(references.cuts)
+    no_counts = [0] * num_cuts
+    stats = np.zeros((num_cuts, len(hyp_stream), NUM_STATS), dtype=np.int64)
+    for seg, tokens in enumerate(hyp_stream):
+        ref_ngrams = references.ngrams[seg]
+        rows = [[0] * NUM_STATS for _ in range(num_cuts)]
+        for ngram, count in extract_ngrams(tokens).items():
+            n = len(ngram)
+            ref_counts = ref_ngrams.get(ngram, no_counts)
+            for c in range(num_cuts):
+                rows[c][n - 1] += min(count, ref_counts[c])
+                rows[c][NGRAM_ORDER + n - 1] += count
+        for c, reflen in enumerate(references.closest_lengths(seg, len(tokens))):
+            rows[c][HYP_LEN] = len(tokens)
+            rows[c][REF_LEN] = reflen
+            stats[c, seg] = rows[c]
+    return stats
+
+
+'''
+On-disk store of sufficient statistics, with one array of shape (num_systems, num_segments, NUM_STATS)
+per (test set, language pair, reference set) and the list of system names alongside it, each with the
+hash of the content of its hypothesis file (so that re-generated or new submissions can be detected).
+
+Arrays are saved in .npy format so that they can be memory-mapped when loaded: system-level,
+segment-level, truncated and bootstrap scores can all be derived from them without re-reading
+or re-tokenising any text.
+'''
+class StatisticsStore:
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, testset, lp, refset):
+        return os.path.join(self.directory, '.'.join([testset, lp, refset]))
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(*key) + '.npy')
+
+    def save(self, testset, lp, refset, systems, stats, hashes=None):
+        path = self.path(testset, lp, refset)
+        # replaced atomically, as the previous array may still be memory-mapped
+        filecache.atomic_write(path + '.npy', lambda fp: np.save(fp, np.asarray(stats, dtype=np.int64)))
+        hashes = [None] * len(systems) if hashes is None else hashes
+        lines = ''.join(system + ('' if file_hash is None else '\t' + file_hash) + '\n' for system, file_hash in zip(systems, hashes))
+        filecache.atomic_write(path + '.systems', lambda fp: fp.write(lines.encode('utf-8')))
+
+    '''
+    Returns the system names, the (memory-mapped) statistics and the hashes of the hypothesis files
+    (None for a system saved without one)
+    '''
+    def load(self, testset, lp, refset, mmap_mode='r'):
+        path = self.path(testset, lp, refset)
+        systems, hashes = [], []
+        with open(path + '.systems') as fp:
+            for line in fp:
+                fields = line.rstrip('\n').split('\t')
+                systems.append(fields[0])
+                hashes.append(fields[1] if len(fields) > 1 else None)
+        return systems, np.load(path + '.npy', mmap_mode=mmap_mode), hashes
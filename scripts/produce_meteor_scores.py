@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""
+Equivalent of produce-metric-scores-{sys,seg}level.sh with scripts/Meteor-{sys,seg}level.sh as the
+evaluation tool, but using a single long-lived Meteor process for all submissions (and all language
+pairs) rather than starting java for each hypothesis file.
+
+The references of each language pair are read once, and every submission is streamed through the
+scorer using Meteor's -stdio protocol:
+
+    SCORE ||| reference 1 ||| ... ||| reference n ||| hypothesis  ->  segment statistics
+    EVAL ||| statistics                                          ->  score
+
+System-level scores are obtained by evaluating the sum of the statistics of all segments, as Meteor
+does when scoring files. Any command speaking the same protocol can be used as the scorer (e.g. a
+stub for testing), using --command.
+"""
+
+import os
+import re
+import sys
+import subprocess
+import lineindex
+import produce_metric_scores as pms
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+
+
+'''
+Path to the Meteor jar: $METEOR_JAR if set, otherwise the last value given in scripts/vars (None if
+neither is given)
+'''
+def get_meteor_jar():
+    if 'METEOR_JAR' in os.environ:
+        return os.environ['METEOR_JAR']
+    meteor_jar = None
+    if os.path.exists(thisdir + '/vars'):
+        with open(thisdir + '/vars') as fp:
+            for line in fp:
+                match = re.match('^METEOR_JAR=(.+?)\s*$', line)
+                if match:
+                    meteor_jar = match.group(1)
+    return meteor_jar
+
+
+'''
+A scorer running in a separate process and speaking Meteor's -stdio protocol (one line per request
+and per answer)
+'''
+class StdioScorer:
+
+    def __init__(self, command):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        encoding='utf-8', bufsize=1)
+
+    def _request(self, line):
+        self.process.stdin.write(line + '\n')
+        self.process.stdin.flush()
+        answer = self.process.stdout.readline()
+        if answer == '':
+            raise EOFError('The scorer process exited unexpectedly')
+        return answer.strip()
+
+    '''
+    Statistics of a hypothesis segment against its references (as a list of numbers)
+    '''
+    def statistics(self, hyp, refs):
+        fields = [clean(x) for x in refs + [hyp]]
+        return [float(x) for x in self._request('SCORE ||| ' + ' ||| '.join(fields)).split()]
+
+    '''
+    Score from (a single segment's or summed) statistics, as output by the scorer
+    '''
+    def score(self, stats):
+        return self._request('EVAL ||| ' + ' '.join(format_stat(x) for x in stats))
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+'''
+Meteor scorer (java -jar METEOR_JAR - - -stdio -l en). Raises a ValueError if no jar is given or found
+'''
+class Meteor(StdioScorer):
+
+    def __init__(self, meteor_jar=None, lang='en', memory='2G'):
+        meteor_jar = get_meteor_jar() if meteor_jar is None else meteor_jar
+        if meteor_jar is None:
+            raise ValueError('No Meteor jar given: use --meteor-jar, set $METEOR_JAR or METEOR_JAR in scripts/vars')
+        if not os.path.exists(meteor_jar):
+            raise ValueError('Meteor jar not found: ' + meteor_jar)
+        super().__init__(['java', '-Xmx' + memory, '-jar', meteor_jar, '-', '-', '-stdio', '-l', lang])
+
+
+# the protocol uses one line per request (the scorer also ends lines at '\r'), with fields separated by |||
+def clean(segment):
+    return segment.rstrip('\r\n').replace('\r', ' ').replace('\n', ' ').replace('|||', '| | |')
+
+
+def format_stat(x):
+    return str(int(x)) if x.is_integer() else repr(x)
+
+
+'''
+Read the lines of several files, as a list of tuples (one per segment), optionally only the
+selected segments (0-based line indices)
+'''
+def read_segments(filenames, segments=None):
+    return list(zip(*[lineindex.read_lines(filename, segments) for filename in filenames]))
+
+
+'''
+Score a set of hypotheses against the references (one tuple of references per segment),
+returning the system-level score or the list of segment-level scores
+'''
+def score_segments(scorer, hyps, refs, level='sys'):
+    if len(hyps) != len(refs):
+        raise EOFError('Hypothesis and reference files have different lengths!')
+    all_stats = [scorer.statistics(hyp, list(seg_refs)) for hyp, seg_refs in zip(hyps, refs)]
+    if level == 'seg':
+        return [scorer.score(stats) for stats in all_stats]
+    return scorer.score([sum(x) for x in zip(*all_stats)])
+
+
+def produce_scores(scorer, testset, metricname, para_ref_folder=None, n=None, level='sys', segments=None,
+                   ref_dir=pms.REF_DIR, hyp_dir=pms.HYP_DIR, out=sys.stdout, maximum=None):
+
+    # for each language pair (no dash, e.g. deen, fien)
+    for lpnodash in pms.get_langpairs(testset, ref_dir):
+        lp = lpnodash[:2] + '-' + lpnodash[2:]
+
+        # references are read once per language pair (the original reference is the last one)
+        ref_files = pms.get_reference_files(testset, lpnodash, para_ref_folder, n, ref_dir)
+        lp_segments = lineindex.select_segments(lineindex.count_lines(ref_files[-1]), segments, maximum, ref_files[-1])
+        os.sys.stderr.write('Reading ' + str(len(ref_files)) + ' references for ' + lp + '\n')
+        refs = read_segments(ref_files, lp_segments)
+
+        for systemname, hyp_file in pms.get_submissions(testset, lp, hyp_dir):
+            hyps = [hyp for hyp, in read_segments([hyp_file], lp_segments)]
+            scores = score_segments(scorer, hyps, refs, level)
+            if level == 'sys':
+                out.write('%s\t%s\t%s\t%s\t%s\n' % (metricname, lp, testset, systemname, scores))
+            else:
+                for segid, score in enumerate(scores, 1):
+                    out.write('%s\t%s\t%s\t%s\t%d\t%s\n' % (metricname, lp, testset, systemname, segid, score))
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('testset', choices=('newstest2018', 'newstest2019'))
+    parser.add_argument('metricname', help="the metric's name (to be written into the output file)")
+    parser.add_argument('para_ref_folder', nargs='?', default=None,
+                        help='folder containing paraphrased references named $lp-$i.en. If not given, only original references are used.')
+    parser.add_argument('n', nargs='?', default=None, type=int, help='the number of paraphrased references to use')
+    parser.add_argument('--level', '-l', default='sys', choices=('sys', 'seg'))
+    parser.add_argument('--maximum', '-m', default=None, type=int, help='only score the first MAXIMUM segments (as *-truncate.sh)')
+    parser.add_argument('--lines', default=None, help='only score this range of segments (START-END, 1-based and inclusive, e.g. 1-500)')
+    parser.add_argument('--line-file', default=None, help='only score the segments whose line numbers (1-based) are listed in this file')
+    parser.add_argument('--reference-dir', default=pms.REF_DIR, help='folder containing the original references')
+    parser.add_argument('--submission-dir', default=pms.HYP_DIR, help='folder containing the MT submissions')
+    parser.add_argument('--meteor-jar', default=None, help='path to the Meteor jar (default: $METEOR_JAR or the value in scripts/vars)')
+    parser.add_argument('--command', default=None,
+                        help='command of a scorer speaking the Meteor -stdio protocol, to use instead of Meteor')
+    args = parser.parse_args()
+
+    if sum(x is not None for x in (args.maximum, args.lines, args.line_file)) > 1:
+        parser.error('only one of --maximum, --lines and --line-file can be given')
+    segments = lineindex.parse_segments(args.lines, args.line_file)
+
+    if args.command is not None:
+        scorer = StdioScorer(args.command.split())
+    else:
+        try:
+            scorer = Meteor(args.meteor_jar)
+        except ValueError as e:
+            parser.error(str(e))
+    try:
+        produce_scores(scorer, args.testset, args.metricname, args.para_ref_folder, args.n, args.level, segments,
+                       args.reference_dir, args.submission_dir, maximum=args.maximum)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        scorer.close()
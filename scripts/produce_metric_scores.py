@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+
+"""
+Python equivalent of produce-metric-scores-{sys,seg}level.sh with scripts/sacreBLEU-{sys,seg}level.sh
+as the evaluation tool. The references of each language pair are read and tokenised once, and
+all MT submissions are scored in the same process.
+
+Writes the same TSV format as the shell scripts:
+
+    sys-level: metricname lp testset system score
+    seg-level: metricname lp testset system segid score
+
+With --bootstrap N, three columns are added to the sys-level output: the mean score over N bootstrap
+resamples of the segments and the bounds of the 95% confidence interval.
+"""
+
+import os
+import re
+import sys
+import hashlib
+import multiprocessing
+import numpy as np
+import parbleu
+import filecache
+import lineindex
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+REF_DIR = thisdir + '/../original-references'
+HYP_DIR = thisdir + '/../mt_submissions'
+
+
+'''
+List the into-English language pairs (without the dash, e.g. deen) for which there is an original reference
+'''
+def get_langpairs(testset, ref_dir=REF_DIR):
+    lps = []
+    for reffile in sorted(os.listdir(ref_dir + '/' + testset)):
+        match = re.match('^.+\-([^-]+?en)\-ref\.en$', reffile)
+        if match:
+            lps.append(match.group(1))
+    return lps
+
+
+'''
+List the reference files for a language pair: the paraphrased references numbered up to n
+(all of them if n is not specified) and finally the original reference
+'''
+def get_reference_files(testset, lpnodash, para_ref_folder=None, n=None, ref_dir=REF_DIR):
+    refs = []
+    if para_ref_folder is not None:
+        for parafile in sorted(os.listdir(para_ref_folder)):
+            match = re.match('^' + lpnodash + '\-(\d+)\.en$', parafile)
+            if not match:
+                continue
+            if n is not None and int(match.group(1)) > n:
+                continue
+            refs.append(para_ref_folder + '/' + parafile)
+    # always add main reference file
+    refs.append(ref_dir + '/' + testset + '/' + testset + '-' + lpnodash + '-ref.en')
+    return refs
+
+
+'''
+Sort key giving the order in which the shell scripts list files (glob under an en_US.UTF-8 locale):
+letters and digits compared case-insensitively first, punctuation ignored, then lowercase before
+uppercase, e.g. dfki-nmt.6478, Facebook_FAIR.6750, ..., online-Y.0, PROMT_NMT_DE-EN.6683, ..., uedin.6749
+and BTRANS.6825 before BTRANS-ensemble.6992
+'''
+def shell_order(filename):
+    alnum = re.sub('[^0-9A-Za-z]', '', filename)
+    return alnum.lower(), alnum.swapcase(), filename
+
+
+'''
+List the (system name, file) submissions of a language pair, in the order of the shell scripts
+(and therefore of the checked-in metric score files)
+'''
+def get_submissions(testset, lp, hyp_dir=HYP_DIR):
+    submissions = []
+    for hypfile in sorted(os.listdir(hyp_dir + '/' + testset), key=shell_order):
+        if not hypfile.startswith(testset) or not hypfile.endswith(lp):
+            continue
+        match = re.match('^' + testset + '\.(.+?\.\d+)\.' + lp + '$', hypfile)
+        systemname = match.group(1) if match else hypfile
+        submissions.append((systemname, hyp_dir + '/' + testset + '/' + hypfile))
+    return submissions
+
+
+'''
+Number of a reference file: i for a paraphrased reference $lp-$i.en, 0 for the original reference
+'''
+def reference_number(ref_file):
+    match = re.match('^.+?\-(\d+)\.en$', os.path.basename(ref_file))
+    return int(match.group(1)) if match else 0
+
+
+'''
+Read and tokenise a hypothesis file (only the selected segments if given)
+'''
+def read_hypotheses(hyp_file, tokenize='13a', segments=None):
+    return parbleu.read_tokenized(hyp_file, tokenize, segments)
+
+
+'''
+Get the score(s) from the statistics: one score (sys-level) or a list of scores (seg-level)
+'''
+def get_scores(stats, level='sys'):
+    if level == 'sys':
+        return parbleu.corpus_bleu(stats)
+    return parbleu.sentence_bleu(stats)
+
+
+'''
+Mean and 95% confidence interval (2.5th and 97.5th percentiles) of the corpus-level score over bootstrap
+resamples, given by the counts of each segment in each resample (see parbleu.bootstrap_counts)
+'''
+def get_interval(stats, counts):
+    scores = parbleu.bootstrap_bleu(stats, counts)
+    lower, upper = np.percentile(scores, [2.5, 97.5])
+    return scores.mean(), lower, upper
+
+
+def write_scores(out, metricname, lp, testset, systemname, scores, level='sys', interval=None):
+    if level == 'sys' and interval is not None:
+        out.write('%s\t%s\t%s\t%s\t%.5f\t%.5f\t%.5f\t%.5f\n' % ((metricname, lp, testset, systemname, scores) + tuple(interval)))
+    elif level == 'sys':
+        out.write('%s\t%s\t%s\t%s\t%.5f\n' % (metricname, lp, testset, systemname, scores))
+    else:
+        for segid, score in enumerate(scores, 1):
+            out.write('%s\t%s\t%s\t%s\t%d\t%.5f\n' % (metricname, lp, testset, systemname, segid, score))
+
+
+'''
+Identifier of the set of references of a language pair in the statistics store, e.g. laser.num=5.<hash>
+or original.<hash>, where the hash is that of the content of the reference files, so that two folders
+with the same name, or edited references, do not share statistics
+'''
+def refset_id(testset, lpnodash, para_ref_folder=None, n=None, ref_dir=REF_DIR):
+    if para_ref_folder is None:
+        name = 'original'
+    else:
+        name = os.path.basename(os.path.normpath(para_ref_folder)) + '.num=' + ('all' if n is None else str(n))
+    hashes = [filecache.file_hash(x) for x in get_reference_files(testset, lpnodash, para_ref_folder, n, ref_dir)]
+    return name + '.' + hashlib.sha1(' '.join(hashes).encode('utf-8')).hexdigest()[:16]
+
+
+# references of the language pair being scored. Set before the worker processes are
+# started, so that they are inherited by them (fork) rather than pickled for each task
+_references = None
+
+
+'''
+Compute the statistics of one hypothesis file against the current references, with shape
+(num_cuts, num_segments, NUM_STATS)
+'''
+def submission_statistics(hyp_file):
+    hyp_stream = read_hypotheses(hyp_file, _references.tokenize, _references.segments)
+    if isinstance(_references, parbleu.NestedReferences):
+        return parbleu.nested_segment_statistics(hyp_stream, _references)
+    return parbleu.segment_statistics(hyp_stream, _references)[np.newaxis]
+
+
+'''
+Compute the per-segment statistics of all submissions of a language pair against each set of
+references (the original reference plus the paraphrased references numbered up to each cut point,
+or all of them if the only cut point is None). All references are read and tokenised once.
+If workers > 1, the submissions are scored in parallel by a pool of processes. If segments (0-based
+line indices) are given, only these lines of the hypotheses and references are read.
+
+Returns the system names and an array of shape (num_cuts, num_systems, num_segments, NUM_STATS)
+'''
+def lp_statistics(testset, lpnodash, para_ref_folder=None, cuts=(None,), ref_dir=REF_DIR, hyp_dir=HYP_DIR,
+                  workers=1, segments=None, submissions=None):
+    global _references
+    lp = lpnodash[:2] + '-' + lpnodash[2:]
+    nested = list(cuts) != [None]
+    ref_files = get_reference_files(testset, lpnodash, para_ref_folder, max(cuts) if nested else None, ref_dir)
+    os.sys.stderr.write('Reading ' + str(len(ref_files)) + ' references for ' + lp + '\n')
+    if nested:
+        _references = parbleu.NestedReferences([(reference_number(x), x) for x in ref_files], cuts,
+                                               segments=segments)
+    else:
+        _references = parbleu.References(ref_files, segments=segments)
+
+    if submissions is None:
+        submissions = get_submissions(testset, lp, hyp_dir)
+    hyp_files = [hyp_file for _, hyp_file in submissions]
+    if workers > 1 and len(hyp_files) > 1:
+        # results are returned in the order of the submissions
+        with multiprocessing.get_context('fork').Pool(min(workers, len(hyp_files))) as pool:
+            all_stats = pool.map(submission_statistics, hyp_files, chunksize=1)
+    else:
+        all_stats = [submission_statistics(hyp_file) for hyp_file in hyp_files]
+
+    num_segments = len(_references)
+    _references = None
+
+    systems = [systemname for systemname, _ in submissions]
+    stats = np.stack(all_stats, axis=1) if all_stats else np.zeros((len(cuts), 0, num_segments, parbleu.NUM_STATS))
+    return systems, stats
+
+
+'''
+Statistics of all the current submissions of a language pair (as lp_statistics, for all segments),
+loaded from the store for each set of references (refsets, one per cut point). The submissions that
+are not in the store with the same content (new or re-generated ones, or all of them if the store
+has no hashes of the hypothesis files) are scored again, and the store is updated
+'''
+def stored_statistics(store, testset, lpnodash, refsets, para_ref_folder=None, cuts=(None,), ref_dir=REF_DIR,
+                      hyp_dir=HYP_DIR, workers=1):
+    lp = lpnodash[:2] + '-' + lpnodash[2:]
+    submissions = get_submissions(testset, lp, hyp_dir)
+    keys = [(systemname, filecache.file_hash(hyp_file)) for systemname, hyp_file in submissions]
+    loaded = [store.load(testset, lp, refset) for refset in refsets]
+    # index of each (system, hash) in the stored statistics of each set of references
+    stored = [{key: i for i, key in enumerate(zip(systems, hashes))} for systems, _, hashes in loaded]
+
+    missing = [i for i, key in enumerate(keys) if any(key not in indices for indices in stored)]
+    if missing:
+        os.sys.stderr.write('Scoring ' + str(len(missing)) + ' new or changed submissions for ' + lp + '\n')
+        _, new_stats = lp_statistics(testset, lpnodash, para_ref_folder, cuts, ref_dir, hyp_dir, workers,
+                                     submissions=[submissions[i] for i in missing])
+    all_stats = []
+    for c, (refset, (_, stats, _), indices) in enumerate(zip(refsets, loaded, stored)):
+        rows = [new_stats[c][missing.index(i)] if i in missing else stats[indices[key]] for i, key in enumerate(keys)]
+        refset_stats = np.stack(rows) if rows else np.zeros((0,) + stats.shape[1:], dtype=stats.dtype)
+        if missing or len(keys) != len(indices):
+            store.save(testset, lp, refset, [name for name, _ in keys], refset_stats, [h for _, h in keys])
+        all_stats.append(refset_stats)
+    return [name for name, _ in keys], all_stats
+
+
+'''
+Produce the scores of all submissions for one or more numbers of paraphrased references (cut points)
+in a single pass. The metric name for each cut point is obtained by replacing {n} in `metricname`,
+and its scores are written to the corresponding stream in `outs`.
+
+If a statistics store is given, the statistics are saved to it, or with `from_stats`, loaded from
+it instead of being computed (see stored_statistics). If segments (0-based line indices) or a maximum are given, only these
+segments (or the first `maximum` segments of each language pair, all of them if there are fewer) are
+scored, and a ValueError is raised if a segment is not in the original reference: without a store, only these lines are read; with a store, the statistics of all segments are
+saved (or loaded) and the selected ones are scored. The output order does not depend on the number
+of worker processes.
+
+If bootstrap is given (sys-level only), the same `bootstrap` resamples of the segments (drawn using
+`seed`) are used for all systems and cut points of a language pair, and the mean and 95% confidence
+interval of the scores are written after each score.
+'''
+def produce_scores(testset, metricname, outs, para_ref_folder=None, cuts=(None,), level='sys',
+                   segments=None, store=None, from_stats=False, ref_dir=REF_DIR, hyp_dir=HYP_DIR, workers=1,
+                   bootstrap=None, seed=None, maximum=None):
+
+    # for each language pair (no dash, e.g. deen, fien)
+    for lpnodash in get_langpairs(testset, ref_dir):
+        lp = lpnodash[:2] + '-' + lpnodash[2:]
+        ref_file = ref_dir + '/' + testset + '/' + testset + '-' + lpnodash + '-ref.en'
+        lp_segments = lineindex.select_segments(lineindex.count_lines(ref_file), segments, maximum, ref_file)
+        refsets = [refset_id(testset, lpnodash, para_ref_folder, cut, ref_dir) for cut in cuts]
+
+        if from_stats:
+            for refset in refsets:
+                if (testset, lp, refset) not in store:
+                    raise ValueError('No statistics for ' + lp + ' and the references ' + refset + ' in ' + store.directory +
+                                     ' (the references have changed, or were not scored with --stats-dir)')
+            systems, all_stats = stored_statistics(store, testset, lpnodash, refsets, para_ref_folder, cuts, ref_dir,
+                                                   hyp_dir, workers)
+        else:
+            systems, all_stats = lp_statistics(testset, lpnodash, para_ref_folder, cuts, ref_dir, hyp_dir, workers,
+                                               lp_segments if store is None else None)
+            if store is not None:
+                hashes = [filecache.file_hash(hyp_file) for _, hyp_file in get_submissions(testset, lp, hyp_dir)]
+                for refset, stats in zip(refsets, all_stats):
+                    store.save(testset, lp, refset, systems, stats, hashes)
+        if store is not None and lp_segments is not None:
+            all_stats = [stats[:, lp_segments] for stats in all_stats]
+
+        counts = None
+        if bootstrap is not None:
+            counts = parbleu.bootstrap_counts(all_stats[0].shape[-2], bootstrap, seed)
+
+        # For each set of hypotheses, compute the metric score
+        for cut, out, stats in zip(cuts, outs, all_stats):
+            for systemname, system_stats in zip(systems, stats):
+                scores = get_scores(system_stats, level)
+                interval = None if counts is None else get_interval(system_stats, counts)
+                write_scores(out, metricname.format(n=cut), lp, testset, systemname, scores, level, interval)
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('testset', choices=('newstest2018', 'newstest2019'))
+    parser.add_argument('metricname', help="the metric's name (to be written into the output file)")
+    parser.add_argument('para_ref_folder', nargs='?', default=None,
+                        help='folder containing paraphrased references named $lp-$i.en. If not given, only original references are used.')
+    parser.add_argument('n', nargs='?', default=None, type=int, help='the number of paraphrased references to use')
+    parser.add_argument('--level', '-l', default='sys', choices=('sys', 'seg'))
+    parser.add_argument('--reference-dir', default=REF_DIR, help='folder containing the original references')
+    parser.add_argument('--submission-dir', default=HYP_DIR, help='folder containing the MT submissions')
+    parser.add_argument('--cuts', nargs='+', type=int, default=None,
+                        help='produce scores for each of these numbers of paraphrased references in a single pass (e.g. 1 2 5 10 20)')
+    parser.add_argument('--output', '-o', default=None,
+                        help='output file (with --cuts, {n} is replaced by each number of paraphrased references, as in NAME)')
+    parser.add_argument('--maximum', '-m', default=None, type=int, help='only score the first MAXIMUM segments (as *-truncate.sh)')
+    parser.add_argument('--lines', default=None, help='only score this range of segments (START-END, 1-based and inclusive, e.g. 1-500)')
+    parser.add_argument('--line-file', default=None, help='only score the segments whose line numbers (1-based) are listed in this file')
+    parser.add_argument('--stats-dir', default=None, help='folder in which to save the sufficient statistics')
+    parser.add_argument('--from-stats', action='store_true', default=False,
+                        help='derive the scores from the statistics saved in --stats-dir instead of computing them')
+    parser.add_argument('--workers', '-w', default=1, type=int, help='number of processes used to score the submissions')
+    parser.add_argument('--bootstrap', default=None, type=int,
+                        help='add the mean and 95%% confidence interval over BOOTSTRAP resamples of the segments (sys-level)')
+    parser.add_argument('--seed', default=12345, type=int, help='random seed of the bootstrap resampling')
+    args = parser.parse_args()
+
+    if args.bootstrap is not None and args.level != 'sys':
+        parser.error('--bootstrap is only available for sys-level scores')
+    if args.from_stats and args.stats_dir is None:
+        parser.error('--from-stats requires --stats-dir')
+    store = None if args.stats_dir is None else parbleu.StatisticsStore(args.stats_dir)
+    if sum(x is not None for x in (args.maximum, args.lines, args.line_file)) > 1:
+        parser.error('only one of --maximum, --lines and --line-file can be given')
+    segments = lineindex.parse_segments(args.lines, args.line_file)
+
+    if args.cuts is not None:
+        if args.para_ref_folder is None or args.output is None or '{n}' not in args.output:
+            parser.error('--cuts requires PARA_REF_FOLDER and an --output filename containing {n}')
+        cuts = sorted(args.cuts if args.n is None else [cut for cut in args.cuts if cut <= args.n])
+        outs = [open(args.output.format(n=cut), 'w') for cut in cuts]
+    else:
+        cuts = [args.n]
+        outs = [sys.stdout if args.output is None else open(args.output, 'w')]
+
+    try:
+        produce_scores(args.testset, args.metricname, outs, args.para_ref_folder, cuts, args.level,
+                       segments, store, args.from_stats, args.reference_dir, args.submission_dir, args.workers,
+                       args.bootstrap, args.seed, args.maximum)
+    except ValueError as e:
+        parser.error(str(e))
+
+    for out in outs:
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+"""
+Greedy selection of the most useful paraphrased references of each language pair, for parBLEU.
+
+Rather than rescoring all submissions for every candidate subset of references, the counts of the
+n-grams of the hypotheses (of all submissions) in each reference are computed once and cached
+(match tables). The clipped n-gram matches of all submissions for a set of references only depend
+on the maximum of these counts over the references, so adding (or removing) one reference only
+updates the matches of the n-grams whose maximum count changes, and the closest reference lengths.
+
+Starting from the original reference alone, the paraphrased reference that most improves the
+objective is added at each step (or, with --backward, starting from all references, the one whose
+removal least degrades it is removed). The objectives are:
+
+    coverage: the proportion of distinct hypothesis n-grams (per segment, pooled over all
+              submissions, as in ngram_coverage.py) found in the references, averaged over n
+    correlation: the Pearson correlation of the system-level BLEU scores with the human DA scores
+
+Writes one line per step: lp objective step reference_number reference_file value
+(step 0 gives the value for the original reference alone, or for all references with --backward)
+"""
+
+import os
+import sys
+import hashlib
+import numpy as np
+import parbleu
+import filecache
+import produce_metric_scores as pms
+import metric_correlation_syslevel as mcs
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+DA_FILE = thisdir + '/../metrics-task/DA-syslevel-{testset}.csv'
+
+NGRAM_ORDER = parbleu.NGRAM_ORDER
+
+
+'''
+Counts of the hypothesis n-grams of a language pair (all submissions) in each reference.
+
+The n-grams occurring in at least one hypothesis are numbered per segment (n-gram j is a
+(segment, n-gram) pair), and the tables are:
+
+- ref_counts: (num_refs, num_ngrams) count of each n-gram in each reference
+- orders: (num_ngrams,) the order of each n-gram
+- entries: one entry per n-gram of each hypothesis, sorted by n-gram (entry_ngram, entry_system,
+           entry_count), with entry_ptr giving the first entry of each n-gram
+- totals: (num_systems, NGRAM_ORDER) number of n-grams of each order in each submission
+- hyp_lengths: (num_systems, num_segments) and ref_lengths: (num_refs, num_segments)
+'''
+class MatchTable:
+
+    ARRAYS = ('ref_counts', 'orders', 'entry_ngram', 'entry_system', 'entry_count', 'totals',
+              'hyp_lengths', 'ref_lengths')
+
+    def __init__(self, arrays):
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.entry_ptr = np.searchsorted(self.entry_ngram, np.arange(len(self.orders) + 1))
+        # bin of each entry when summing matches by (system, order)
+        self.entry_bin = self.entry_system * NGRAM_ORDER + self.orders[self.entry_ngram] - 1
+        self.num_systems, self.num_segments = self.hyp_lengths.shape
+
+    @classmethod
+    def build(cls, hyp_streams, ref_streams):
+        num_systems, num_refs = len(hyp_streams), len(ref_streams)
+        num_segments = len(ref_streams[0])
+        for stream in list(hyp_streams) + list(ref_streams):
+            if len(stream) != num_segments:
+                raise EOFError('Hypothesis and reference files have different lengths!')
+
+        orders, ref_entries, entries = [], [], []
+        totals = np.zeros((num_systems, NGRAM_ORDER), dtype=np.int64)
+        for seg in range(num_segments):
+            # n-grams of this segment, numbered after those of the previous segments
+            ids = {}
+            for system, stream in enumerate(hyp_streams):
+                for ngram, count in parbleu.extract_ngrams(stream[seg]).items():
+                    if ngram not in ids:
+                        ids[ngram] = len(orders)
+                        orders.append(len(ngram))
+                    entries.append((ids[ngram], system, count))
+                    totals[system, len(ngram) - 1] += count
+            for ref, stream in enumerate(ref_streams):
+                for ngram, count in parbleu.extract_ngrams(stream[seg]).items():
+                    if ngram in ids:
+                        ref_entries.append((ref, ids[ngram], count))
+
+        ref_counts = np.zeros((num_refs, len(orders)), dtype=np.int32)
+        if ref_entries:
+            ref, ngram, count = np.array(ref_entries, dtype=np.int64).T
+            ref_counts[ref, ngram] = count
+        entries = np.array(entries, dtype=np.int64).reshape(-1, 3)
+        entries = entries[np.argsort(entries[:, 0], kind='stable')]
+
+        return cls({'ref_counts': ref_counts,
+                    'orders': np.array(orders, dtype=np.int64),
+                    'entry_ngram': entries[:, 0],
+                    'entry_system': entries[:, 1],
+                    'entry_count': entries[:, 2],
+                    'totals': totals,
+                    'hyp_lengths': np.array([[len(x) for x in stream] for stream in hyp_streams], dtype=np.int64),
+                    'ref_lengths': np.array([[len(x) for x in stream] for stream in ref_streams], dtype=np.int64)})
+
+    '''
+    Match table of hypothesis and reference files, cached (keyed by the hashes of all the files)
+    '''
+    @classmethod
+    def from_files(cls, hyp_files, ref_files, tokenize='13a'):
+        key = hashlib.sha1(' '.join([tokenize, str(NGRAM_ORDER)] + [filecache.file_hash(x) for x in hyp_files] + ['|'] +
+                                    [filecache.file_hash(x) for x in ref_files]).encode('utf-8')).hexdigest()
+        cached = filecache.cache_path('matches', key, '.npz')
+        if os.path.exists(cached):
+            with np.load(cached) as arrays:
+                return cls(arrays)
+        table = cls.build([parbleu.read_tokenized(x, tokenize) for x in hyp_files],
+                          [parbleu.read_tokenized(x, tokenize, newline='\n') for x in ref_files])
+        filecache.atomic_write(cached, lambda fp: np.savez(fp, **{name: getattr(table, name) for name in cls.ARRAYS}))
+        return table
+
+    # indices of the entries of the given n-grams
+    def _entries(self, ngrams):
+        starts, ends = self.entry_ptr[ngrams], self.entry_ptr[ngrams + 1]
+        sizes = ends - starts
+        offsets = np.repeat(starts - np.cumsum(sizes) + sizes, sizes)
+        return offsets + np.arange(sizes.sum())
+
+    '''
+    Clipped matches of each submission for each order, shape (num_systems, NGRAM_ORDER), given the
+    maximum reference count of each n-gram
+    '''
+    def matches(self, max_counts):
+        clipped = np.minimum(self.entry_count, max_counts[self.entry_ngram])
+        return self._sum_by_bin(np.arange(len(clipped)), clipped)
+
+    '''
+    Change in the clipped matches when the maximum reference counts of some n-grams change
+    '''
+    def delta_matches(self, ngrams, old_counts, new_counts):
+        entries = self._entries(ngrams)
+        counts = self.entry_count[entries]
+        ngram = self.entry_ngram[entries]
+        delta = np.minimum(counts, new_counts[ngram]) - np.minimum(counts, old_counts[ngram])
+        return self._sum_by_bin(entries, delta)
+
+    def _sum_by_bin(self, entries, values):
+        sums = np.bincount(self.entry_bin[entries], weights=values, minlength=self.num_systems * NGRAM_ORDER)
+        return sums.astype(np.int64).reshape(self.num_systems, NGRAM_ORDER)
+
+    '''
+    Closest reference length of each hypothesis segment (the shorter one in case of a tie),
+    shape (num_systems, num_segments)
+    '''
+    def closest_lengths(self, refs):
+        ref_lengths = self.ref_lengths[refs][np.newaxis]
+        diff = np.abs(ref_lengths - self.hyp_lengths[:, np.newaxis])
+        # order by difference, then by length
+        base = ref_lengths.max() + 1
+        return (diff * base + ref_lengths).min(axis=1) % base
+
+    '''
+    Closest reference lengths after adding a reference
+    '''
+    def add_closest_lengths(self, closest, ref):
+        ref_lengths = self.ref_lengths[ref][np.newaxis]
+        new_diff = np.abs(ref_lengths - self.hyp_lengths)
+        old_diff = np.abs(closest - self.hyp_lengths)
+        better = (new_diff < old_diff) | ((new_diff == old_diff) & (ref_lengths < closest))
+        return np.where(better, ref_lengths, closest)
+
+    '''
+    System-level statistics of all submissions, shape (num_systems, NUM_STATS)
+    '''
+    def statistics(self, matches, closest):
+        stats = np.zeros((self.num_systems, parbleu.NUM_STATS), dtype=np.int64)
+        stats[:, parbleu.CORRECT] = matches
+        stats[:, parbleu.TOTAL] = self.totals
+        stats[:, parbleu.HYP_LEN] = self.hyp_lengths.sum(axis=1)
+        stats[:, parbleu.REF_LEN] = closest.sum(axis=1)
+        return stats
+
+    '''
+    Proportion of distinct hypothesis n-grams found in the references, for each order
+    '''
+    def coverage(self, max_counts):
+        covered = np.bincount(self.orders[max_counts > 0], minlength=NGRAM_ORDER + 1)[1:]
+        total = np.bincount(self.orders, minlength=NGRAM_ORDER + 1)[1:]
+        return covered / np.maximum(total, 1)
+
+
+'''
+Objective to maximise, from the maximum reference counts and the system-level statistics
+'''
+class Coverage:
+
+    def __call__(self, table, max_counts, stats):
+        return float(table.coverage(max_counts).mean())
+
+
+class Correlation:
+
+    def __init__(self, systems, human_scores):
+        self.indices = [i for i, system in enumerate(systems) if system in human_scores]
+        self.human = np.array([human_scores[systems[i]] for i in self.indices])
+        if len(self.indices) < 3:
+            raise ValueError('Not enough systems with human scores to compute a correlation')
+
+    def __call__(self, table, max_counts, stats):
+        scores = parbleu.bleu(stats[self.indices])
+        return float(np.corrcoef(scores, self.human)[0, 1])
+
+
+'''
+Greedy forward selection: starting from the `start` references, add the candidate reference that
+gives the highest objective, k times (all candidates if k is None).
+Returns a list of (reference, objective value), starting with (None, value of the start set)
+'''
+def greedy_add(table, objective, start, candidates, k=None):
+    selected = list(start)
+    candidates = list(candidates)
+    max_counts = table.ref_counts[selected].max(axis=0)
+    matches = table.matches(max_counts)
+    closest = table.closest_lengths(selected)
+    steps = [(None, objective(table, max_counts, table.statistics(matches, closest)))]
+
+    while candidates and (k is None or len(steps) <= k):
+        best = None
+        for ref in candidates:
+            ngrams = np.flatnonzero(table.ref_counts[ref] > max_counts)
+            new_counts = max_counts.copy()
+            new_counts[ngrams] = table.ref_counts[ref, ngrams]
+            new_matches = matches + table.delta_matches(ngrams, max_counts, new_counts)
+            new_closest = table.add_closest_lengths(closest, ref)
+            value = objective(table, new_counts, table.statistics(new_matches, new_closest))
+            # ties are broken in favour of the first candidate
+            if best is None or value > best[1]:
+                best = (ref, value, new_counts, new_matches, new_closest)
+        ref, value, max_counts, matches, closest = best
+        candidates.remove(ref)
+        selected.append(ref)
+        steps.append((ref, value))
+    return steps
+
+
+'''
+Greedy backward elimination: starting from all the `start` and `candidates` references, remove the
+candidate reference whose removal gives the highest objective, k times (all candidates if k is None).
+The maximum counts without each reference are obtained from the largest and second largest counts.
+Returns a list of (reference, objective value), starting with (None, value of the full set)
+'''
+def greedy_remove(table, objective, start, candidates, k=None):
+    candidates = list(candidates)
+    selected = list(start) + candidates
+
+    def top_two(selected):
+        counts = table.ref_counts[selected]
+        owner = counts.argmax(axis=0)
+        first = counts.max(axis=0)
+        second = np.partition(counts, len(selected) - 2, axis=0)[len(selected) - 2] if len(selected) > 1 \
+            else np.zeros_like(first)
+        return first, second, np.array(selected)[owner]
+
+    max_counts, second, owner = top_two(selected)
+    matches = table.matches(max_counts)
+    steps = [(None, objective(table, max_counts, table.statistics(matches, table.closest_lengths(selected))))]
+
+    while candidates and (k is None or len(steps) <= k):
+        best = None
+        for ref in candidates:
+            ngrams = np.flatnonzero((owner == ref) & (second < max_counts))
+            new_counts = max_counts.copy()
+            new_counts[ngrams] = second[ngrams]
+            new_matches = matches + table.delta_matches(ngrams, max_counts, new_counts)
+            new_closest = table.closest_lengths([x for x in selected if x != ref])
+            value = objective(table, new_counts, table.statistics(new_matches, new_closest))
+            if best is None or value > best[1]:
+                best = (ref, value, new_matches)
+        ref, value, matches = best
+        candidates.remove(ref)
+        selected.remove(ref)
+        max_counts, second, owner = top_two(selected)
+        steps.append((ref, value))
+    return steps
+
+
+def select_references(testset, para_ref_folder, objective='coverage', human_scores=None, k=None, backward=False,
+                      langpair=None, ref_dir=pms.REF_DIR, hyp_dir=pms.HYP_DIR, out=sys.stdout):
+
+    lp2human = None
+    if objective == 'correlation':
+        lp2human = mcs.read_ref(DA_FILE.format(testset=testset) if human_scores is None else human_scores)
+
+    # for each language pair (no dash, e.g. deen, fien)
+    for lpnodash in pms.get_langpairs(testset, ref_dir):
+        lp = lpnodash[:2] + '-' + lpnodash[2:]
+        if langpair is not None and lp != langpair and lpnodash != langpair:
+            continue
+
+        ref_files = pms.get_reference_files(testset, lpnodash, para_ref_folder, None, ref_dir)
+        submissions = pms.get_submissions(testset, lp, hyp_dir)
+        os.sys.stderr.write('Reading ' + str(len(ref_files)) + ' references and ' + str(len(submissions)) +
+                            ' submissions for ' + lp + '\n')
+        table = MatchTable.from_files([hyp_file for _, hyp_file in submissions], ref_files)
+
+        if objective == 'correlation':
+            if lp not in lp2human:
+                os.sys.stderr.write('No human scores for ' + lp + '\n')
+                continue
+            metric = Correlation([systemname for systemname, _ in submissions], lp2human[lp])
+        else:
+            metric = Coverage()
+
+        # the original reference (last) is always included
+        original, paraphrases = len(ref_files) - 1, list(range(len(ref_files) - 1))
+        greedy = greedy_remove if backward else greedy_add
+        for step, (ref, value) in enumerate(greedy(table, metric, [original], paraphrases, k)):
+            if ref is None:
+                number, name = '-', 'all' if backward else 'original'
+            else:
+                number, name = str(pms.reference_number(ref_files[ref])), os.path.basename(ref_files[ref])
+            out.write('%s\t%s\t%d\t%s\t%s\t%.5f\n' % (lp, objective, step, number, name, value))
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('testset', choices=('newstest2018', 'newstest2019'))
+    parser.add_argument('para_ref_folder', help='folder containing paraphrased references named $lp-$i.en')
+    parser.add_argument('--objective', default='coverage', choices=('coverage', 'correlation'))
+    parser.add_argument('--human-scores', default=None,
+                        help='human DA scores file (default: metrics-task/DA-syslevel-TESTSET.csv)')
+    parser.add_argument('-k', default=None, type=int, help='number of references to add (or remove) (default: all)')
+    parser.add_argument('--backward', action='store_true', default=False,
+                        help='start from all the references and remove them one at a time')
+    parser.add_argument('--langpair', '-l', default=None, help='only this language pair (e.g. de-en)')
+    parser.add_argument('--reference-dir', default=pms.REF_DIR, help='folder containing the original references')
+    parser.add_argument('--submission-dir', default=pms.HYP_DIR, help='folder containing the MT submissions')
+    args = parser.parse_args()
+
+    select_references(args.testset, args.para_ref_folder, args.objective, args.human_scores, args.k, args.backward,
+                      args.langpair, args.reference_dir, args.submission_dir)
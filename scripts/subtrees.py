@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+"""
+Hash-consed store of labelled subtrees, shared by the tree comparison methods (tree kernel in
+tree_kernel.py, rule intersection and tree edit distance in syntactic_similarity.py).
+
+Each distinct subtree (label and sequence of children, which are subtrees or words) is stored once and
+given an integer id, so that identical subtrees (e.g. the same NP in several paraphrases of a sentence)
+have the same id, and two subtrees are identical if and only if their ids are equal. The ids are
+numbers in the order in which the subtrees were first added to the store; each subtree also has a
+Merkle-style digest (a 64-bit hash of its label and of the digests of its children), which does not
+depend on the store, e.g. to compare subtrees across processes.
+
+A tree is represented by the id of its root (None for an empty tree), and by the multiset of the ids
+of its subtrees (one per node).
+"""
+
+import hashlib
+from collections import Counter
+
+
+'''
+Store of distinct subtrees. For each id: its label, its items (a tuple of subtree ids and words), its
+children (subtree ids only) and the id of its production (its label and, for each item, the label of
+the subtree or the word, distinguishing subtrees from words as nltk's productions, so that (CD 2018)
+and (CD (2018)) have different productions). Its digest is computed when needed
+'''
+class SubtreeStore:
+
+    def __init__(self):
+        self.ids = {}
+        self.labels, self.items, self.children, self.productions = [], [], [], []
+        self.production_ids = {}
+        self._digests = {}
+        # multisets of the subtrees and sets of the rules of the trees added, by root id
+        self._counts, self._rule_sets = {}, {}
+
+    def __len__(self):
+        return len(self.labels)
+
+    '''
+    Id of the subtree with this label and these children (ids of subtrees, or words)
+    '''
+    def intern(self, label, items):
+        key = (label, tuple(items))
+        subtree = self.ids.get(key)
+        if subtree is None:
+            subtree = len(self.labels)
+            self.ids[key] = subtree
+            self.labels.append(label)
+            self.items.append(key[1])
+            children = tuple(x for x in key[1] if not isinstance(x, str))
+            self.children.append(children)
+            production = (label, tuple((False, x) if isinstance(x, str) else (True, self.labels[x]) for x in key[1]))
+            self.productions.append(self.production_ids.setdefault(production, len(self.production_ids)))
+        return subtree
+
+    '''
+    Id of the rule of a subtree (the same for two subtrees if and only if their nltk productions are equal)
+    '''
+    def rule(self, subtree):
+        return self.productions[subtree]
+
+    '''
+    Digest of a subtree (a 64-bit hash of its label and of the digests of its children, or words)
+    '''
+    def digest(self, subtree):
+        if subtree not in self._digests:
+            self._digests[subtree] = _digest(self.labels[subtree],
+                                             [x if isinstance(x, str) else self.digest(x) for x in self.items[subtree]])
+        return self._digests[subtree]
+
+    '''
+    Add a tree in bracketed format, e.g. ( (S (NP (PRP I)) (VP (VBD enjoyed) (NP (PRP$ my) (NN cookie)))) ),
+    and return the id of its root (None if the string is empty)
+    '''
+    def add(self, string):
+        tokens = string.replace('(', ' ( ').replace(')', ' ) ').split()
+        if not tokens:
+            return None
+        root, end = self._parse(tokens, 0)
+        if end != len(tokens):
+            raise ValueError('Trailing tokens in tree: ' + string)
+        return root
+
+    # parse the subtree starting at tokens[i] == '(' and return its id and the following position
+    def _parse(self, tokens, i):
+        if tokens[i] != '(':
+            raise ValueError('Expected ( at position ' + str(i))
+        i += 1
+        label = ''
+        if tokens[i] not in ('(', ')'):
+            label = tokens[i]
+            i += 1
+        children = []
+        while tokens[i] != ')':
+            if tokens[i] == '(':
+                child, i = self._parse(tokens, i)
+                children.append(child)
+            else:
+                children.append(tokens[i])
+                i += 1
+        return self.intern(label, children), i + 1
+
+    '''
+    Add an nltk tree and return the id of its root
+    '''
+    def add_nltk(self, tree):
+        if isinstance(tree, str):
+            return self.intern(tree, ())
+        return self.intern(tree.label(), [child if isinstance(child, str) else self.add_nltk(child) for child in tree])
+
+    '''
+    Multiset of the ids of the subtrees of a tree (one per node), as a Counter
+    '''
+    def counts(self, root):
+        if root is None:
+            return Counter()
+        if root not in self._counts:
+            nodes, stack = [], [root]
+            while stack:
+                subtree = stack.pop()
+                nodes.append(subtree)
+                stack.extend(self.children[subtree])
+            self._counts[root] = Counter(nodes)
+        return self._counts[root]
+
+    '''
+    Set of the ids of the rules of a tree (as the set of nltk's productions)
+    '''
+    def rule_set(self, root):
+        if root is None:
+            return frozenset()
+        if root not in self._rule_sets:
+            self._rule_sets[root] = frozenset(self.rule(subtree) for subtree in self.counts(root))
+        return self._rule_sets[root]
+
+    def is_preterminal(self, subtree):
+        return not self.children[subtree]
+
+
+# 64-bit hash of a label and of the digests of the children (or words)
+def _digest(label, children):
+    hasher = hashlib.blake2b(digest_size=8)
+    hasher.update(repr((label, tuple(children))).encode('utf-8'))
+    return int.from_bytes(hasher.digest(), 'big')
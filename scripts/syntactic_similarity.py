@@ -5,6 +5,7 @@ from apted import APTED, helpers
 from nltk import Tree
 import re
 import os
+import subtrees
 
 def apted_tree_format(tree):
     '''
@@ -29,6 +30,13 @@ def apted(tree1, tree2):
     str_t1 = apted_tree_format(tree1).strip()[1:-1].strip()
     str_t2 = apted_tree_format(tree2).strip()[1:-1].strip()
 
+    return apted_distance(str_t1, str_t2)
+
+
+def apted_distance(str_t1, str_t2):
+    '''
+    Tree edit distance between two trees in apted string format (without outer brackets)
+    '''
     # convert to apted tree from apted format
     t1 = helpers.Tree.from_text(str_t1)
     t2 = helpers.Tree.from_text(str_t2)
@@ -38,6 +46,19 @@ def apted(tree1, tree2):
     return apted.compute_edit_distance()
 
 
+def apted_subtree_format(store, subtree):
+    '''
+    Convert a subtree of a store (see subtrees.py) to apted string format, as apted_tree_format
+    '''
+    strtree = " {" + store.labels[subtree]
+    for item in store.items[subtree]:
+        if isinstance(item, str):
+            strtree += " {" + item + "} "
+        else:
+            strtree += apted_subtree_format(store, item)
+    return strtree + "} "
+
+
 
 def rule_intersection(tree1, tree2, norm_length=True):
     '''
@@ -58,6 +79,23 @@ def rule_intersection(tree1, tree2, norm_length=True):
         return len_inter
 
 
+def subtree_rule_intersection(store, root1, root2, norm_length=True):
+    '''
+    rule_intersection between two trees of a store (see subtrees.py),
+    computed on the sets of the ids of their rules
+    '''
+    p1 = store.rule_set(root1)
+    p2 = store.rule_set(root2)
+
+    len_inter = len(p1 & p2)
+
+    if norm_length:
+        denom = (len(p1) + len(p2)) / 2
+        return len_inter / denom
+    else:
+        return len_inter
+
+
 def compare_trees(tree1, tree2, method):
     '''
     Compare 2 NLTK trees using the specified method
@@ -138,13 +176,43 @@ def compare_all_trees(trees, method):
     else:
         os.sys.stderr.write('This is a similarity metric so the greater the value the better!\n')
 
-    similarities = np.zeros((len(trees), len(trees))) # similarity matrix
-    for t1, tree1 in enumerate(trees):
-        for t2, tree2 in enumerate(trees):
-            similarity = compare_trees(tree1, tree2, method=method)
-            similarities[t1, t2] = similarity
+    print(similarity_matrix(trees, method))
+
+
+def similarity_matrix(trees, method, store=None):
+    '''
+    Compare all pairs of a list of NLTK trees (as compare_trees), returning the
+    similarity matrix. Each tree is added once to a store of subtrees (see
+    subtrees.py), so that identical trees have the same id: each pair of
+    distinct trees is only compared once (both methods are symmetric), and
+    the edit distance between identical trees is 0. Rules are compared as
+    sets of integer ids
+    '''
+    store = subtrees.SubtreeStore() if store is None else store
+    roots = [store.add_nltk(tree) for tree in trees]
+    apted_strings = {}
+    scores = {}
 
-    print(similarities)
+    similarities = np.zeros((len(trees), len(trees))) # similarity matrix
+    for t1, root1 in enumerate(roots):
+        for t2, root2 in enumerate(roots):
+            key = (min(root1, root2), max(root1, root2))
+            if key not in scores:
+                if method == 'ted':
+                    if root1 == root2:
+                        scores[key] = 0
+                    else:
+                        for root in key:
+                            if root not in apted_strings:
+                                apted_strings[root] = apted_subtree_format(store, root).strip()[1:-1].strip()
+                        scores[key] = apted_distance(apted_strings[root1], apted_strings[root2])
+                elif method == 'rule_intersection':
+                    scores[key] = subtree_rule_intersection(store, root1, root2)
+                else:
+                    exit("No comparison method specified")
+            similarities[t1, t2] = scores[key]
+
+    return similarities
 
 
 
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+Subset tree kernel between constituency trees, computed with Moschitti's fast tree kernel algorithm
+("Making Tree Kernels Practical for Natural Language Learning", EACL 2006), in-process rather than
+with tools/TreeKernel/tree-kernel/compare-trees.
+
+The trees are stored as hash-consed subtrees (subtrees.py), indexed by production, so that the pairs of
+nodes with the same production are found directly, and the kernel is only computed for these pairs:
+
+    delta(n1, n2) = 0                                   if the productions differ
+                    lambda                              if n1 and n2 are pre-terminals
+                    lambda * prod_j (1 + delta(c1j, c2j)) otherwise
+
+    K(t1, t2) = sum over n1, n2 of delta(n1, n2)
+
+The normalised kernel is K(t1, t2) / sqrt(K(t1, t1) * K(t2, t2)) (nan if one of the trees has no
+nodes). Trees are in bracketed format, e.g. ( (S (NP (PRP I)) (VP (VBD enjoyed) (NP (PRP$ my) (NN cookie)))) )
+"""
+
+import math
+import numpy as np
+import subtrees
+
+# decay factor
+LAMBDA = 0.4
+
+
+'''
+Subset tree kernels between the trees of a store of subtrees (see subtrees.py). Since delta(n1, n2) only
+depends on the subtrees rooted at n1 and n2, it is computed once per pair of distinct subtrees (and
+memoised for all the trees of the store, e.g. all the paraphrases of a sentence), and the kernel of two
+trees is computed from the multisets of their subtrees:
+
+    K(t1, t2) = sum over subtrees s1 of t1, s2 of t2 with the same production of c1(s1) c2(s2) delta(s1, s2)
+
+where c1(s1) is the number of nodes of t1 whose subtree is s1
+'''
+class SubtreeKernel:
+
+    def __init__(self, store=None, lam=LAMBDA):
+        self.store = subtrees.SubtreeStore() if store is None else store
+        self.lam = lam
+        self.deltas = {}
+        # subtrees of each tree (with their numbers of occurrences) by production, by root id
+        self.indices = {}
+
+    '''
+    Add a tree (string) to the store and return its root id
+    '''
+    def add(self, string):
+        return self.store.add(string)
+
+    def delta(self, subtree1, subtree2):
+        store = self.store
+        if store.productions[subtree1] != store.productions[subtree2]:
+            return 0.
+        key = (subtree1, subtree2) if subtree1 <= subtree2 else (subtree2, subtree1)
+        value = self.deltas.get(key)
+        if value is None:
+            value = self.lam
+            for child1, child2 in zip(store.children[subtree1], store.children[subtree2]):
+                value *= 1 + self.delta(child1, child2)
+            self.deltas[key] = value
+        return value
+
+    # subtrees of a tree and their numbers of occurrences, by production
+    def _index(self, root):
+        if root not in self.indices:
+            index = {}
+            for subtree, count in self.store.counts(root).items():
+                index.setdefault(self.store.productions[subtree], []).append((subtree, count))
+            self.indices[root] = index
+        return self.indices[root]
+
+    '''
+    Unnormalised kernel between two trees (root ids)
+    '''
+    def kernel(self, root1, root2):
+        index1, index2 = self._index(root1), self._index(root2)
+        if len(index1) > len(index2):
+            index1, index2 = index2, index1
+        total = 0.
+        for production, subtrees1 in index1.items():
+            subtrees2 = index2.get(production)
+            if subtrees2 is not None:
+                for subtree1, count1 in subtrees1:
+                    for subtree2, count2 in subtrees2:
+                        total += count1 * count2 * self.delta(subtree1, subtree2)
+        return total
+
+    '''
+    Normalised kernel between two trees (root ids)
+    '''
+    def normalised(self, root1, root2):
+        return normalise(self.kernel(root1, root2), self.kernel(root1, root1), self.kernel(root2, root2))
+
+
+'''
+Normalised kernel, given the kernel of two trees and their kernels with themselves
+'''
+def normalise(k12, k11, k22):
+    if k11 == 0 or k22 == 0:
+        return float('nan')
+    return k12 / math.sqrt(k11 * k22)
+
+
+'''
+Normalised tree kernel between two trees (strings), as compare-trees
+'''
+def tree_kernel(string1, string2, lam=LAMBDA):
+    kernels = SubtreeKernel(lam=lam)
+    return kernels.normalised(kernels.add(string1), kernels.add(string2))
+
+
+'''
+Normalised tree kernels between all pairs of a group of trees (strings), e.g. the paraphrases of a
+sentence. Each tree is parsed once into a store of subtrees shared by the group, the deltas of pairs
+of subtrees are computed once for the group, and the kernel of each tree with itself is computed once.
+Returns a symmetric matrix of shape (num_trees, num_trees)
+'''
+def kernel_matrix(strings, lam=LAMBDA):
+    kernels = SubtreeKernel(lam=lam)
+    roots = [kernels.add(string) for string in strings]
+    selves = [kernels.kernel(root, root) for root in roots]
+    matrix = np.ones((len(roots), len(roots)))
+    for i, root1 in enumerate(roots):
+        matrix[i, i] = normalise(selves[i], selves[i], selves[i])
+        for j in range(i + 1, len(roots)):
+            # identical trees
+            if roots[j] == root1:
+                kernel = selves[i]
+            else:
+                kernel = kernels.kernel(root1, roots[j])
+            matrix[i, j] = matrix[j, i] = normalise(kernel, selves[i], selves[j])
+    return matrix
+
+
+if __name__ == '__main__':
+
+    import sys
+    import argparse
+    parser = argparse.ArgumentParser(description='Normalised tree kernel of pairs of trees (one tab-separated pair per line)')
+    parser.add_argument('--lam', default=LAMBDA, type=float, help='decay factor')
+    args = parser.parse_args()
+
+    for line in sys.stdin:
+        string1, string2 = line.rstrip('\n').split('\t')
+        print(tree_kernel(string1, string2, args.lam))
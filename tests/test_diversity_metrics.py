@@ -0,0 +1,25 @@
+import calculate_diversity as cd
+
+PARAS = [
+    'The cat sat on the mat.',
+    'The cat was sitting on the mat.',
+    'A cat sat on a mat, and the cat slept.',
+    'Mat.',
+    '',
+    'the the the the cat',
+]
+
+
+def test_bleu_pairwise():
+    metric = cd.BLEU()
+    scores = metric.pairwise(PARAS)
+    assert scores.tolist() == [[metric(hyp, ref) for ref in PARAS] for hyp in PARAS]
+
+
+def test_bow_pairwise_all():
+    sentences = [PARAS, PARAS[::-1], PARAS[1:3], ['Same words, same words.'] * 2]
+    for tokenize in ('13a', None):
+        metric = cd.BOW(tokenize)
+        # several chunks, with tokens already seen in the previous ones
+        for scores, paras in zip(metric.pairwise_all(sentences, chunksize=3), sentences):
+            assert scores.tolist() == [[metric(x, y) for y in paras] for x in paras]
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+import calculate_diversity as cd
+
+
+def read_records(filename):
+    with open(filename) as fp:
+        return [json.loads(line) for line in fp]
+
+
+def test_complete_results_not_finished_twice(tmp_path):
+    filename = str(tmp_path / 'results.jsonl')
+    config = {'metric': 'bow', 'inputs': {'deen': ['0123']}}
+    results = cd.DiversityResults(filename, config)
+    results.finish_lang('deen', 0.5, 1.0, 2)
+    results.finish(0.5, 2)
+    results.close()
+
+    # resuming a finished run
+    results = cd.DiversityResults(filename, config)
+    assert 'deen' in results.finished
+    results.finish(0.5, 2)
+    results.close()
+    assert [record for record in read_records(filename) if 'all' in record] == [{'all': 0.5, 'num_sentences': 2}]
+
+
+def test_different_inputs(tmp_path):
+    filename = str(tmp_path / 'results.jsonl')
+    cd.DiversityResults(filename, {'metric': 'bow', 'inputs': {'deen': ['0123']}}).close()
+    with pytest.raises(ValueError):
+        cd.DiversityResults(filename, {'metric': 'bow', 'inputs': {'deen': ['4567']}})
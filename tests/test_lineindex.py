@@ -0,0 +1,27 @@
+import pytest
+
+import lineindex
+
+
+@pytest.fixture
+def three_lines(tmp_path):
+    filename = tmp_path / 'three.txt'
+    filename.write_text('a\nb\nc\n')
+    return str(filename)
+
+
+def test_maximum_larger_than_file(three_lines):
+    num_lines = lineindex.count_lines(three_lines)
+    assert num_lines == 3
+    segments = lineindex.select_segments(num_lines, maximum=10)
+    assert segments == [0, 1, 2]
+    assert lineindex.read_lines(three_lines, segments) == ['a', 'b', 'c']
+
+
+def test_lines_outside_file(three_lines):
+    segments = lineindex.parse_segments('2-4')
+    with pytest.raises(ValueError):
+        lineindex.select_segments(lineindex.count_lines(three_lines), segments)
+    with pytest.raises(ValueError):
+        lineindex.read_lines(three_lines, segments)
+    assert lineindex.select_segments(3, lineindex.parse_segments('2-3')) == [1, 2]
@@ -0,0 +1,39 @@
+import numpy as np
+
+import metric_correlation_seglevel as mcseg
+
+
+def judgments(num_segments, num_comparisons):
+    hscores = mcseg.Judgments()
+    for i in range(num_segments):
+        hscores.segments.intern(str(i))
+    hscores.segment = np.arange(num_comparisons) % num_segments
+    return hscores
+
+
+def test_resample_all_comparisons():
+    random = np.random.RandomState(1)
+    comparisons = [(x, ~x) for x in random.rand(3, 50) < 0.6]
+    taus = mcseg.bootstrap_taus(judgments(10, 50), comparisons, 20, np.random.RandomState(2), resample_all=True)
+
+    # each repetition draws 50 comparisons with replacement
+    random = np.random.RandomState(2)
+    for repetition in range(20):
+        sampled = random.choice(50, 50)
+        for metric, (concordant, discordant) in enumerate(comparisons):
+            concord, discord = concordant[sampled].sum(), discordant[sampled].sum()
+            assert taus[metric, repetition] == (concord - discord) / (concord + discord)
+
+
+def test_legacy_resampling():
+    random = np.random.RandomState(1)
+    comparisons = [(x, ~x) for x in random.rand(3, 50) < 0.6]
+    taus = mcseg.bootstrap_taus(judgments(10, 50), comparisons, 20, np.random.RandomState(2))
+
+    # only the first 10 (number of segments) draws, without duplicates
+    random = np.random.RandomState(2)
+    for repetition in range(20):
+        sampled = sorted(set(random.choice(50, 50)[:10]))
+        for metric, (concordant, discordant) in enumerate(comparisons):
+            concord, discord = concordant[sampled].sum(), discordant[sampled].sum()
+            assert taus[metric, repetition] == (concord - discord) / (concord + discord)
@@ -0,0 +1,48 @@
+import pytest
+import sacrebleu
+from sacrebleu.sacrebleu import TOKENIZERS
+
+import filecache
+import parbleu
+
+REFS = [
+    ['The cat sat on the mat.', 'A dog barked loudly at the mailman, who ran away.', 'It is raining.', 'Hello world', 'One two three four five six.'],
+    ['The cat was sitting on the mat.', 'The dog barked at the postman.', 'Rain is falling today.', 'Hi there, world!', 'One two three.'],
+]
+HYPS = [
+    'the cat sat on the mat.',
+    'A dog barked at the mailman who ran.',
+    'Sunny.',
+    '',
+    'One two three four five six.',
+]
+
+
+@pytest.fixture
+def ref_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(filecache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    files = []
+    for i, ref in enumerate(REFS):
+        files.append(str(tmp_path / ('ref%d.en' % i)))
+        with open(files[-1], 'w') as fp:
+            fp.write(''.join(line + '\n' for line in ref))
+    return files
+
+
+def statistics(ref_files, num_refs):
+    references = parbleu.References(ref_files[:num_refs])
+    return parbleu.segment_statistics([TOKENIZERS['13a'](x).split() for x in HYPS], references)
+
+
+@pytest.mark.parametrize('num_refs', [1, 2])
+def test_corpus_bleu(ref_files, num_refs):
+    expected = sacrebleu.corpus_bleu(HYPS, REFS[:num_refs]).score
+    assert parbleu.corpus_bleu(statistics(ref_files, num_refs)) == expected
+
+
+@pytest.mark.parametrize('num_refs', [1, 2])
+def test_sentence_bleu(ref_files, num_refs):
+    # as sacrebleu -sl (whose default smoothing is exp)
+    expected = [sacrebleu.sentence_bleu(hyp, [[ref[i]] for ref in REFS[:num_refs]], smooth_method='exp').score for i, hyp in enumerate(HYPS)]
+    assert parbleu.sentence_bleu(statistics(ref_files, num_refs)).tolist() == expected
+
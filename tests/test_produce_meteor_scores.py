@@ -0,0 +1,67 @@
+import io
+import sys
+
+import pytest
+
+import produce_meteor_scores as pms
+
+# a scorer speaking the -stdio protocol: the statistics of a segment are the number of hypothesis
+# tokens found in a reference and the number of hypothesis tokens, and the score is their ratio. Like
+# Meteor (java's readLine), it also ends lines at '\r'
+STUB = r'''
+import io
+import sys
+for line in io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline=None):
+    fields = [x.strip() for x in line.rstrip('\n').split('|||')]
+    if fields[0] == 'SCORE':
+        refs, hyp = fields[1:-1], fields[-1].split()
+        print(sum(any(x in ref.split() for ref in refs) for x in hyp), len(hyp), flush=True)
+    elif fields[0] == 'EVAL':
+        matches, length = [float(x) for x in fields[1].split()]
+        print(matches / length if length else 0.0, flush=True)
+    else:
+        print('unknown request', flush=True)
+'''
+
+
+@pytest.fixture
+def testset(tmp_path):
+    (tmp_path / 'stub.py').write_text(STUB)
+    (tmp_path / 'refs' / 'newstest2019').mkdir(parents=True)
+    (tmp_path / 'refs' / 'newstest2019' / 'newstest2019-deen-ref.en').write_text('the cat sat on the mat\na dog barked loudly\n')
+    (tmp_path / 'paras').mkdir()
+    # Windows line endings (the paraphrases come before the hypothesis in the requests)
+    (tmp_path / 'paras' / 'deen-1.en').write_bytes(b'a cat is on the mat\r\nthe dog barked ||| loudly\r\n')
+    (tmp_path / 'hyps' / 'newstest2019').mkdir(parents=True)
+    (tmp_path / 'hyps' / 'newstest2019' / 'newstest2019.a.1.de-en').write_text('the cat sat on a rug\na dog barked\n')
+    (tmp_path / 'hyps' / 'newstest2019' / 'newstest2019.b.2.de-en').write_bytes(b'a cat is on the mat\r\nthe dog slept\r\n')
+    return tmp_path
+
+
+def scores(testset, **kwargs):
+    scorer = pms.StdioScorer([sys.executable, str(testset / 'stub.py')])
+    out = io.StringIO()
+    try:
+        pms.produce_scores(scorer, 'newstest2019', 'm', ref_dir=str(testset / 'refs'), hyp_dir=str(testset / 'hyps'),
+                           out=out, **kwargs)
+    finally:
+        scorer.close()
+    return out.getvalue().splitlines()
+
+
+def test_syslevel(testset):
+    assert scores(testset) == ['m\tde-en\tnewstest2019\ta.1\t0.7777777777777778', 'm\tde-en\tnewstest2019\tb.2\t0.5555555555555556']
+
+
+def test_seglevel_with_paraphrases(testset):
+    assert scores(testset, para_ref_folder=str(testset / 'paras'), level='seg') == [
+        'm\tde-en\tnewstest2019\ta.1\t1\t0.8333333333333334',
+        'm\tde-en\tnewstest2019\ta.1\t2\t1.0',
+        'm\tde-en\tnewstest2019\tb.2\t1\t1.0',
+        'm\tde-en\tnewstest2019\tb.2\t2\t0.6666666666666666',
+    ]
+
+
+def test_maximum(testset):
+    assert scores(testset, level='seg', maximum=1) == ['m\tde-en\tnewstest2019\ta.1\t1\t0.6666666666666666',
+                                                       'm\tde-en\tnewstest2019\tb.2\t1\t0.6666666666666666']
@@ -0,0 +1,31 @@
+import os
+import random
+from collections import OrderedDict
+
+import produce_metric_scores as pms
+
+METRIC_SCORES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'metric-scores')
+
+
+# systems of each (testset, lp) in the order of a checked-in sys-level score file
+def checked_in_order(filename):
+    systems = OrderedDict()
+    with open(os.path.join(METRIC_SCORES, filename)) as fp:
+        for line in fp:
+            _, lp, testset, system = line.split('\t')[:4]
+            systems.setdefault((testset, lp), []).append(system)
+    return systems
+
+
+def test_submissions_in_shell_order(tmp_path):
+    systems = checked_in_order('newstest2019/sacreBLEU-syslevel.tsv')
+    assert ('newstest2019', 'de-en') in systems
+    filenames = ['newstest2019.' + system + '.' + lp for (_, lp), lp_systems in systems.items() for system in lp_systems]
+    random.Random(1).shuffle(filenames)
+    (tmp_path / 'newstest2019').mkdir()
+    for filename in filenames:
+        (tmp_path / 'newstest2019' / filename).touch()
+
+    for (testset, lp), lp_systems in systems.items():
+        submissions = pms.get_submissions(testset, lp, str(tmp_path))
+        assert [systemname for systemname, _ in submissions] == lp_systems
@@ -0,0 +1,36 @@
+import io
+
+import pytest
+
+import filecache
+import parbleu
+import produce_metric_scores as pms
+
+
+@pytest.fixture
+def testset(tmp_path, monkeypatch):
+    monkeypatch.setattr(filecache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    (tmp_path / 'refs' / 'newstest2019').mkdir(parents=True)
+    (tmp_path / 'refs' / 'newstest2019' / 'newstest2019-deen-ref.en').write_text('the cat sat on the mat\na dog barked loudly\n')
+    (tmp_path / 'hyps' / 'newstest2019').mkdir(parents=True)
+    (tmp_path / 'hyps' / 'newstest2019' / 'newstest2019.a.1.de-en').write_text('the cat sat on a mat\na dog barked\n')
+    (tmp_path / 'hyps' / 'newstest2019' / 'newstest2019.b.2.de-en').write_text('a cat is on the mat\nthe dog barked loudly\n')
+    return tmp_path
+
+
+def scores(testset, **kwargs):
+    out = io.StringIO()
+    pms.produce_scores('newstest2019', 'm', [out], ref_dir=str(testset / 'refs'), hyp_dir=str(testset / 'hyps'), **kwargs)
+    return out.getvalue()
+
+
+def test_from_stats_follows_submissions(testset):
+    store = parbleu.StatisticsStore(str(testset / 'stats'))
+    assert scores(testset, store=store) == scores(testset, store=store, from_stats=True)
+
+    # a re-generated and a new submission
+    (testset / 'hyps' / 'newstest2019' / 'newstest2019.a.1.de-en').write_text('the cat sat on the mat\na dog barked loudly\n')
+    (testset / 'hyps' / 'newstest2019' / 'newstest2019.c.3.de-en').write_text('cat\ndog\n')
+    expected = scores(testset)
+    assert [line.split('\t')[3] for line in expected.splitlines()] == ['a.1', 'b.2', 'c.3']
+    assert scores(testset, store=store, from_stats=True) == expected
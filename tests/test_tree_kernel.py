@@ -0,0 +1,59 @@
+import math
+import os
+
+import pytest
+from nltk import Tree
+
+import tree_kernel
+
+PARSES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'paraphrases-parses', 'newstest2019', 'human')
+
+
+def read_parses(filename, num_sentences=40):
+    with open(os.path.join(PARSES, filename)) as fp:
+        return [line.strip() for line, _ in zip(fp, range(num_sentences))]
+
+
+# plain recursive Collins-Duffy subset tree kernel over nltk trees
+def naive_kernel(string1, string2, lam=tree_kernel.LAMBDA):
+    def production(node):
+        return node.label(), tuple((isinstance(x, Tree), x.label() if isinstance(x, Tree) else x) for x in node)
+
+    def delta(node1, node2):
+        if production(node1) != production(node2):
+            return 0.
+        value = lam
+        for child1, child2 in zip(node1, node2):
+            if isinstance(child1, Tree):
+                value *= 1 + delta(child1, child2)
+        return value
+
+    def kernel(tree1, tree2):
+        return sum(delta(node1, node2) for node1 in tree1.subtrees() for node2 in tree2.subtrees())
+
+    tree1 = Tree.fromstring(string1, remove_empty_top_bracketing=False)
+    tree2 = Tree.fromstring(string2, remove_empty_top_bracketing=False)
+    return tree_kernel.normalise(kernel(tree1, tree2), kernel(tree1, tree1), kernel(tree2, tree2))
+
+
+def test_word_and_subtree_children_differ():
+    # (CD 2018) is a pre-terminal and (CD (2018)) is not: only the root and NP nodes match
+    kernels = tree_kernel.SubtreeKernel()
+    root1 = kernels.add('( (NP (CD 2018)) )')
+    root2 = kernels.add('( (NP (CD (2018))) )')
+    lam = tree_kernel.LAMBDA
+    assert kernels.kernel(root1, root2) == pytest.approx(lam + lam * (1 + lam))
+
+
+def test_naive_kernel_on_parses():
+    for string1, string2 in zip(read_parses('deen-1.en.parse'), read_parses('deen-2.en.parse')):
+        assert tree_kernel.tree_kernel(string1, string2) == pytest.approx(naive_kernel(string1, string2))
+
+
+def test_symmetric_on_parses():
+    trees1, trees2 = read_parses('deen-1.en.parse'), read_parses('deen-3.en.parse')
+    for string1, string2 in zip(trees1, trees2):
+        assert tree_kernel.tree_kernel(string1, string2) == pytest.approx(tree_kernel.tree_kernel(string2, string1))
+    matrix = tree_kernel.kernel_matrix(trees1[:10] + trees2[:10])
+    assert (matrix == matrix.T).all()
+    assert not math.isnan(matrix.sum())